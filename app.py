@@ -1,35 +1,2604 @@
-from flask import Flask, render_template_string, request, redirect, url_for, jsonify
-from datetime import datetime, timedelta
+from flask import Flask, Response, g, has_request_context, request, redirect, url_for, jsonify, stream_with_context
+from markupsafe import Markup
+from datetime import datetime, timedelta, timezone
+import atexit
+import base64
+import bisect
+import csv
+import fcntl
+import functools
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import mmap
 import os
-from collections import defaultdict
+import re
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections import OrderedDict, defaultdict
+from collections.abc import MutableMapping, MutableSequence
+from contextlib import contextmanager
+
+import click
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this-in-production'
 
+# Storage backend: 'json' (the files below) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+SQLITE_FILE = os.environ.get('SQLITE_FILE', 'financial_data.db')
+
+# Snapshot format: 'json', or 'binary' for a compact column file that readers
+# memory-map (see write_snapshot). A snapshot in the other format, left from
+# before switching, is converted on first load. Under gunicorn, binary is the
+# one to use: every worker maps the same file, so the ledger and its date and
+# ID indexes sit in the page cache once per host, and a fresh worker is ready
+# without parsing anything.
+SNAPSHOT_FORMAT = os.environ.get('SNAPSHOT_FORMAT', 'json')
+SNAPSHOT_FILES = {'json': 'financial_data.json', 'binary': 'financial_data.snap'}
+
 # Data storage file
-DATA_FILE = 'financial_data.json'
+DATA_FILE = SNAPSHOT_FILES[SNAPSHOT_FORMAT]
+
+# Time partitions: 'off', 'year' or 'month'. When on, compaction seals each
+# closed period into a partition of its own (see seal_partitions) and the
+# snapshot and journal above hold only the open period.
+LEDGER_PARTITIONS = os.environ.get('LEDGER_PARTITIONS', 'off')
+PARTITION_LENGTH = {'off': None, 'year': 4, 'month': 7}[LEDGER_PARTITIONS]
+PARTITIONS_DIR = 'financial_data.partitions'
+PARTITIONS_MANIFEST = os.path.join(PARTITIONS_DIR, 'manifest.json')
+# Held exclusively by whichever worker process is writing; a writer waiting
+# for it checks again this often (seconds)
+LOCK_FILE = 'financial_data.lock'
+WRITE_LOCK_POLL_INTERVAL = 0.005
+
+# Append-only journal of adds and deletes, folded into DATA_FILE on compaction
+JOURNAL_FILE = 'financial_data.journal'
+JOURNAL_MODE = os.environ.get('JOURNAL_MODE', 'on') != 'off'
+# fsync the journal every N records or within N seconds of an unsynced
+# append, whichever comes first
+JOURNAL_FSYNC_EVERY = int(os.environ.get('JOURNAL_FSYNC_EVERY', '32'))
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get('JOURNAL_FSYNC_INTERVAL', '1.0'))
+# Compact in the background once the journal holds this many records
+JOURNAL_COMPACT_AT = int(os.environ.get('JOURNAL_COMPACT_AT', '10000'))
+
+# Running totals for the dashboard and /api/summary, kept next to the ledger
+AGGREGATES_FILE = 'financial_data.aggregates.json'
+
+# Build aggregates over a NumPy column store (vectorized group-bys)
+COLUMNAR_STORE = np is not None and os.environ.get('COLUMNAR_STORE', 'on') != 'off'
+
+# /export streams its CSV in chunks of roughly this many characters
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Batches larger than this drop the date and listing indexes and let them
+# rebuild on next use rather than inserting into them row by row
+INDEX_REBUILD_BATCH = 1000
+# How many rejected rows /api/transactions/bulk describes in its response
+BULK_MAX_ERRORS = 100
+# Page sizes for /api/transactions
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 500
+# /api/report results kept per worker, least recently used dropped first
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', '256'))
+# /api/stream checks the ledger version this often (seconds), and sends a
+# comment line when it has been quiet this long so proxies keep it open
+STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', '1.0'))
+STREAM_KEEPALIVE_INTERVAL = 15
+# Each open stream holds a worker thread, so a stream ends after this long
+# (seconds) and the browser reconnects after STREAM_RETRY_MS, and at most
+# STREAM_MAX_OPEN streams are open per worker: keep it below the thread
+# count in the Procfile so other requests always have threads. Past the
+# limit a stream ends at once and is retried after STREAM_BUSY_RETRY_MS.
+STREAM_MAX_SECONDS = float(os.environ.get('STREAM_MAX_SECONDS', '300'))
+STREAM_MAX_OPEN = int(os.environ.get('STREAM_MAX_OPEN', '4'))
+STREAM_RETRY_MS = 1000
+STREAM_BUSY_RETRY_MS = 30000
+
+# Read endpoints that answer conditional GETs from the ledger version alone
+CONDITIONAL_ENDPOINTS = {'index', 'api_summary', 'api_transactions', 'api_report', 'api_search', 'export_csv'}
+# Responses of these types and at least this size are gzip/deflate encoded
+COMPRESSIBLE_TYPES = {'text/html', 'text/csv', 'application/json'}
+COMPRESS_MIN_SIZE = 1024
+
+# Histogram buckets (seconds) for request and phase timings at /metrics
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Requests slower than this many milliseconds are logged with their phase
+# breakdown; 0 turns the log off
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '500'))
 
 # Initialize data structure
 def init_data():
-    if not os.path.exists(DATA_FILE):
-        data = {
-            'income': [],
-            'expenses': []
-        }
-        save_data(data)
+    with ledger_write_lock():
+        if not any(os.path.exists(path) for path in SNAPSHOT_FILES.values()):
+            data = {
+                'income': [],
+                'expenses': []
+            }
+            save_data(data)
     return load_data()
 
+# Per-worker ledger cache, only re-parsed when the data files change on disk
+_ledger_cache = {
+    'signature': None,
+    'snapshot_path': DATA_FILE,
+    'data': None,
+    'generation': 0,
+    'journal_ino': None,
+    'journal_offset': 0,
+    'journal_records': 0,
+    'journal_stale': False,
+    'journal_generation': 0,
+    'aggregates': None,
+    'day_totals': None,
+    'date_index': None,
+    'search_index': None,
+    'id_index': None,
+    'listing_indexes': None,
+    'tombstones': 0,
+}
+cache_stats = {'hits': 0, 'misses': 0, 'replays': 0}
+_ledger_lock = threading.RLock()
+# Notified when the writer lock is let go. Waiting on it lets go of
+# _ledger_lock, however many times this thread has taken it.
+_writer_released = threading.Condition(_ledger_lock)
+_write_lock = {'depth': 0, 'fd': None, 'owner': None}
+_journal_sync = {'pending': 0, 'last': time.monotonic(), 'timer': None}
+_compacting = threading.Event()
+
+# Instrumentation. Each request's time is split into phases (load_data,
+# aggregation, render, save) and both are kept as per-route histograms for
+# /metrics. Counters are per worker process.
+PHASES = ('load_data', 'aggregation', 'render', 'save')
+_histograms = {}
+_metrics_lock = threading.Lock()
+_phase_stack = threading.local()
+write_stats = {'add': 0, 'delete': 0}
+dashboard_cache_stats = {'hits': 0, 'misses': 0}
+report_cache_stats = {'hits': 0, 'misses': 0}
+
+def observe(metric, labels, seconds):
+    # labels is a tuple of (name, value) pairs
+    with _metrics_lock:
+        histogram = _histograms.get((metric, labels))
+        if histogram is None:
+            histogram = _histograms[(metric, labels)] = {'buckets': [0] * (len(METRICS_BUCKETS) + 1), 'sum': 0.0}
+        histogram['buckets'][bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        histogram['sum'] += seconds
+
+@contextmanager
+def timed(phase):
+    # Times a block (or, as a decorator, a function) as `phase`. Nested
+    # phases are subtracted from the enclosing one so phases never overlap.
+    stack = _phase_stack.__dict__.setdefault('nested', [])
+    stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        own = elapsed - stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        if has_request_context():
+            phases = g.setdefault('phases', {})
+            phases[phase] = phases.get(phase, 0.0) + own
+        else:
+            observe('financial_phase_seconds', (('route', 'background'), ('phase', phase)), own)
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+@contextmanager
+def ledger_writer():
+    # Serializes writers across threads and gunicorn worker processes.
+    # Re-entrant within a thread; readers never take it. Holding it keeps
+    # the ledger from changing but lets this worker's readers in; waiting
+    # for it lets go of _ledger_lock, so readers (and readers that need the
+    # writer lock themselves) carry on meanwhile.
+    me = threading.get_ident()
+    with _ledger_lock:
+        if _write_lock['owner'] != me:
+            while _write_lock['owner'] is not None:
+                _writer_released.wait()
+            fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    # Held by another process; checked again shortly
+                    _writer_released.wait(WRITE_LOCK_POLL_INTERVAL)
+                    while _write_lock['owner'] is not None:
+                        _writer_released.wait()
+            _write_lock['owner'] = me
+            _write_lock['fd'] = fd
+        _write_lock['depth'] += 1
+    try:
+        yield
+    finally:
+        with _ledger_lock:
+            _write_lock['depth'] -= 1
+            if _write_lock['depth'] == 0:
+                fd = _write_lock['fd']
+                _write_lock['fd'] = None
+                _write_lock['owner'] = None
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+                _writer_released.notify_all()
+
+@contextmanager
+def ledger_write_lock():
+    # The writer lock, and _ledger_lock so readers in this worker wait until
+    # the write is done
+    with ledger_writer(), _ledger_lock:
+        yield
+
+def write_file_atomic(path, write, mode='w'):
+    # Readers see either the old file or the complete new one, never a partial write
+    tmp_file = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_file, mode) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+# Amounts are kept and summed as integer cents, so totals are exact; they
+# are only turned back into euros for display
+def to_cents(amount):
+    return round(float(amount) * 100)
+
+def from_cents(cents):
+    return cents / 100
+
+# Ledger entries in memory. Stored as dicts of strings and floats, they are
+# parsed once at load into slotted records: the amount in cents, dates and
+# categories shared between entries, and the timestamp packed into an
+# integer when it round-trips. They read and write like the dicts they are
+# stored as (entry['amount'], entry.setdefault('id', ...), dict(entry)).
+ENTRY_FIELDS = ('date', 'description', 'amount', 'category', 'timestamp', 'id')
+_entry_fields = frozenset(ENTRY_FIELDS)
+TIMESTAMP_EPOCH = datetime(1970, 1, 1)
+_shared_strings = {}
+
+def pack_timestamp(timestamp):
+    # Microseconds since the epoch, or the string itself if that would not
+    # give back the same string
+    try:
+        moment = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return timestamp
+    if moment.tzinfo is not None or moment.isoformat() != timestamp:
+        return timestamp
+    return (moment - TIMESTAMP_EPOCH) // timedelta(microseconds=1)
+
+def unpack_timestamp(packed):
+    if isinstance(packed, int):
+        return (TIMESTAMP_EPOCH + timedelta(microseconds=packed)).isoformat()
+    return packed
+
+class Entry(MutableMapping):
+    __slots__ = ('date', 'description', 'cents', 'category', 'packed_timestamp', 'id')
+
+    def __init__(self, fields):
+        # __setitem__ inlined: this runs for every entry at load
+        for name, value in fields.items():
+            if name == 'date' or name == 'category':
+                value = _shared_strings.setdefault(value, value)
+            elif name == 'amount':
+                name, value = 'cents', to_cents(value)
+            elif name == 'timestamp':
+                name, value = 'packed_timestamp', pack_timestamp(value)
+            setattr(self, name, value)
+
+    def __getitem__(self, name):
+        try:
+            if name == 'amount':
+                return from_cents(self.cents)
+            if name == 'timestamp':
+                return unpack_timestamp(self.packed_timestamp)
+            if name in ENTRY_FIELDS:
+                return getattr(self, name)
+        except AttributeError:
+            pass
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        if name == 'amount':
+            self.cents = to_cents(value)
+        elif name == 'timestamp':
+            self.packed_timestamp = pack_timestamp(value)
+        elif name in ('date', 'category'):
+            setattr(self, name, _shared_strings.setdefault(value, value))
+        else:
+            setattr(self, name, value)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        delattr(self, {'amount': 'cents', 'timestamp': 'packed_timestamp'}.get(name, name))
+
+    def __iter__(self):
+        return (name for name in ENTRY_FIELDS if name in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+def ledger_entry(fields):
+    # Entries with fields this app does not know are kept as they are
+    if not isinstance(fields, dict) or not fields.keys() <= _entry_fields:
+        return fields
+    return Entry(fields)
+
+def entry_value(entry, name):
+    # entry.get(name), where the name 'cents' is the amount in cents
+    if name != 'cents':
+        return entry.get(name)
+    if isinstance(entry, Entry):
+        return entry.cents
+    return to_cents(entry['amount'])
+
+# Binary snapshot layout, in native byte order:
+#   header   SNAPSHOT_HEADER: magic, format version, byte order mark,
+#            generation, income and expense record counts, string count and
+#            string data size
+#   strings  uint64 offsets (count + 1), then the UTF-8 string data
+#   columns  for income, then expenses, one fixed-width column per field in
+#            SNAPSHOT_COLUMNS followed by the SNAPSHOT_INDEXES (version 2)
+# Sections start on 8-byte boundaries. Text fields are indexes into the
+# deduplicated string table, so a reader maps the file and touches only the
+# columns it needs; descriptions are decoded only for rows actually shown.
+# The indexes are row numbers in date and in ID order, so date ranges and ID
+# lookups bisect the mapping instead of each worker building its own.
+# Amounts are integer cents from version 3 on (float euros before).
+# Workers pick up a new snapshot by its generation and inode; the old mapping
+# stays valid until they let go of it.
+SNAPSHOT_MAGIC = b'FLSN'
+SNAPSHOT_VERSION = 3
+SNAPSHOT_BYTE_ORDER = 0x0102
+SNAPSHOT_HEADER = struct.Struct('=4sHHQQQQQ')
+SNAPSHOT_COLUMNS = (
+    ('date', 'I'),
+    ('description', 'I'),
+    ('amount', 'q'),
+    ('category', 'I'),
+    ('timestamp', 'I'),
+    ('id', 'I'),
+)
+SNAPSHOT_INDEXES = ('by_date', 'by_id')
+
+def _padding(size):
+    return b'\0' * (-size % 8)
+
+def write_snapshot(f, data, generation):
+    strings = {}
+    columns = {}
+    for kind in ('income', 'expenses'):
+        columns[kind] = {name: array(typecode) for name, typecode in SNAPSHOT_COLUMNS}
+        for entry in data[kind]:
+            for name, column in columns[kind].items():
+                if name == 'amount':
+                    column.append(entry_value(entry, 'cents'))
+                else:
+                    column.append(strings.setdefault(str(entry.get(name, '')), len(strings)))
+        rows = range(len(data[kind]))
+        dates = [entry['date'] for entry in data[kind]]
+        ids = [str(entry.get('id', '')) for entry in data[kind]]
+        columns[kind]['by_date'] = array('I', sorted(rows, key=dates.__getitem__))
+        columns[kind]['by_id'] = array('I', sorted(rows, key=ids.__getitem__))
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = array('Q', [0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+
+    f.write(SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_BYTE_ORDER, generation,
+        len(data['income']), len(data['expenses']), len(encoded), offsets[-1]
+    ))
+    f.write(offsets.tobytes())
+    f.write(b''.join(encoded))
+    f.write(_padding(offsets[-1]))
+    for kind in ('income', 'expenses'):
+        for column in columns[kind].values():
+            f.write(column.tobytes())
+            f.write(_padding(len(column) * column.itemsize))
+
+class Snapshot:
+    # A memory-mapped binary snapshot. Columns are memoryviews straight onto
+    # the mapping; nothing is read until it is indexed.
+    def __init__(self, f):
+        buffer = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        magic, version, byte_order, self.generation, n_income, n_expenses, n_strings, string_size = \
+            SNAPSHOT_HEADER.unpack_from(buffer)
+        self.cents = version >= 3
+        # Version 1 files have no index sections; their indexes are built in
+        # each worker as for JSON
+        if magic != SNAPSHOT_MAGIC or version not in (1, 2, SNAPSHOT_VERSION):
+            raise ValueError(f'{f.name} is not a version {SNAPSHOT_VERSION} ledger snapshot')
+        if byte_order != SNAPSHOT_BYTE_ORDER:
+            raise ValueError(f'{f.name} was written on a machine with a different byte order')
+        offset = SNAPSHOT_HEADER.size
+        self.offsets = buffer[offset:offset + 8 * (n_strings + 1)].cast('Q')
+        offset += 8 * (n_strings + 1)
+        self.strings = buffer[offset:offset + string_size]
+        offset += string_size + len(_padding(string_size))
+        self.columns = {}
+        self.indexes = {}
+        for kind, count in (('income', n_income), ('expenses', n_expenses)):
+            self.columns[kind] = {}
+            self.indexes[kind] = {}
+            sections = [
+                (self.columns[kind], name, 'd' if name == 'amount' and version < 3 else typecode)
+                for name, typecode in SNAPSHOT_COLUMNS
+            ]
+            if version >= 2:
+                sections += [(self.indexes[kind], name, 'I') for name in SNAPSHOT_INDEXES]
+            for section, name, typecode in sections:
+                size = count * struct.calcsize(typecode)
+                section[name] = buffer[offset:offset + size].cast(typecode)
+                offset += size + len(_padding(size))
+
+    def string(self, code):
+        return str(self.strings[self.offsets[code]:self.offsets[code + 1]], 'utf-8')
+
+    def entries(self):
+        return {kind: SnapshotEntries(self, kind) for kind in ('income', 'expenses')}
+
+class SnapshotEntries(MutableSequence):
+    # One kind's ledger list backed by a Snapshot. Rows are decoded into
+    # dicts when read; tombstones and rows added since the snapshot was
+    # written are kept in Python. Anything that shifts positions (deletes by
+    # index from old journals) turns it into a plain in-memory list.
+    def __init__(self, snapshot, kind):
+        self.snapshot = snapshot
+        self.columns = snapshot.columns[kind]
+        self.indexes = snapshot.indexes[kind]
+        self.base = len(self.columns['amount'])
+        self.replaced = {}
+        self.appended = []
+
+    @property
+    def indexed(self):
+        # Leading positions covered by the snapshot's own indexes
+        return self.base if self.indexes else 0
+
+    def __len__(self):
+        return self.base + len(self.appended)
+
+    def _position(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('ledger position out of range')
+        return position
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        position = self._position(position)
+        if position >= self.base:
+            return self.appended[position - self.base]
+        if position in self.replaced:
+            return self.replaced[position]
+        return {name: self._field(name, position) for name, _ in SNAPSHOT_COLUMNS}
+
+    def _field(self, name, position):
+        # Also 'cents', the amount in cents
+        if name in ('amount', 'cents'):
+            value = self.columns['amount'][position]
+            if self.snapshot.cents:
+                return value if name == 'cents' else from_cents(value)
+            return to_cents(value) if name == 'cents' else value
+        return self.snapshot.string(self.columns[name][position])
+
+    def __setitem__(self, position, entry):
+        position = self._position(position)
+        if position >= self.base:
+            self.appended[position - self.base] = entry
+        else:
+            self.replaced[position] = entry
+
+    def _materialize(self):
+        self.appended = list(self)
+        self.base = 0
+        self.replaced = {}
+        self.indexes = {}
+
+    def __delitem__(self, position):
+        position = self._position(position)
+        self._materialize()
+        del self.appended[position]
+
+    def insert(self, position, entry):
+        self._materialize()
+        self.appended.insert(position, entry)
+
+    def append(self, entry):
+        self.appended.append(entry)
+
+    def values(self, name, start=0):
+        # One field of every slot from start on (None for tombstones), read
+        # from its column alone; each distinct string is decoded once
+        if name in ('amount', 'cents'):
+            values = self.columns['amount'][start:self.base].tolist()
+            if name == 'amount' and self.snapshot.cents:
+                values = [from_cents(cents) for cents in values]
+            elif name == 'cents' and not self.snapshot.cents:
+                values = [to_cents(amount) for amount in values]
+        else:
+            values = self.columns[name][start:self.base].tolist()
+            decoded = {}
+            for code in set(values):
+                decoded[code] = self.snapshot.string(code)
+            values = [decoded[code] for code in values]
+        for position, entry in self.replaced.items():
+            if position >= start:
+                values[position - start] = None if entry is None else entry_value(entry, name)
+        values.extend(
+            None if entry is None else entry_value(entry, name)
+            for entry in self.appended[max(start - self.base, 0):]
+        )
+        return values
+
+    def fields(self, position, names):
+        # A tuple of some fields of one row, or None for a tombstone
+        if position >= self.base or position in self.replaced:
+            entry = self[position]
+            return None if entry is None else tuple(entry_value(entry, name) for name in names)
+        return tuple(self._field(name, position) for name in names)
+
+    def date_positions(self, start, end):
+        # Snapshot rows dated start..end in date order, bisected on the
+        # by_date index; tombstones are included
+        order = self.indexes['by_date']
+        dates = SortedField(self, 'date', order)
+        lo = bisect.bisect_left(dates, start) if start else 0
+        hi = bisect.bisect_right(dates, end + DATE_PREFIX_END) if end else len(order)
+        return order[lo:hi].tolist()
+
+    def find_id(self, entry_id):
+        # Position of the snapshot row with this ID, if it is still live
+        order = self.indexes['by_id']
+        i = bisect.bisect_left(SortedField(self, 'id', order), entry_id)
+        if i < len(order) and self._field('id', order[i]) == entry_id:
+            if self.replaced.get(order[i], True) is not None:
+                return order[i]
+        return None
+
+class SortedField:
+    # One text field of a snapshot's rows, read in the order of one of its
+    # indexes; a sequence bisect can search without decoding the column
+    def __init__(self, entries, name, order):
+        self.entries = entries
+        self.name = name
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.entries._field(self.name, self.order[i])
+
+def column_values(entries, name, start=0):
+    # One field (or 'cents') of every slot of a ledger list from start on,
+    # None for tombstones (and, in lists, entries without the field)
+    if isinstance(entries, SnapshotEntries):
+        return entries.values(name, start)
+    return [None if entry is None else entry_value(entry, name) for entry in entries[start:]]
+
+def indexed_positions(entries):
+    # How many leading positions of a ledger list the snapshot indexes
+    # cover; per-worker indexes only hold the rest
+    return entries.indexed if isinstance(entries, SnapshotEntries) else 0
+
+def entry_fields(entries, position, names):
+    if isinstance(entries, SnapshotEntries):
+        return entries.fields(position, names)
+    entry = entries[position]
+    return None if entry is None else tuple(entry_value(entry, name) for name in names)
+
+@timed('save')
 def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+    # Writes a full snapshot; in journal mode this also starts a fresh journal.
+    # Tombstoned (deleted) slots are dropped here.
+    with ledger_write_lock():
+        generation = _ledger_cache['generation'] + 1
+        live = {kind: [entry for entry in data[kind] if entry is not None] for kind in ('income', 'expenses')}
+        remaining = seal_partitions(live, generation) if LEDGER_PARTITIONS != 'off' else live
+        # Sealing moves entries out, so positions change as for a new ledger
+        fresh = remaining is not live or data is not _ledger_cache['data'] or _ledger_cache['aggregates'] is None
+        _install_snapshot(_write_snapshot_file(remaining, generation), remaining, generation, fresh)
+
+def _write_snapshot_file(live, generation):
+    # Writes and fsyncs the snapshot next to DATA_FILE; _install_snapshot
+    # moves it into place
+    tmp_file = f'{DATA_FILE}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_file, 'wb' if SNAPSHOT_FORMAT == 'binary' else 'w') as f:
+        if SNAPSHOT_FORMAT == 'binary':
+            write_snapshot(f, live, generation)
+        else:
+            json.dump(dict(live, generation=generation), f, indent=2, default=dict)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_file
 
+def _install_snapshot(tmp_file, live, generation, fresh):
+    # Replaces DATA_FILE and the cached ledger, and starts a fresh journal
+    with ledger_write_lock():
+        os.replace(tmp_file, DATA_FILE)
+        for path in SNAPSHOT_FILES.values():
+            if path != DATA_FILE and os.path.exists(path):
+                # A converted snapshot in the other format, now stale
+                os.remove(path)
+        if fresh or _ledger_cache['tombstones']:
+            # Ledger positions changed
+            _ledger_cache['date_index'] = None
+            _ledger_cache['search_index'] = None
+            _ledger_cache['listing_indexes'] = None
+            _ledger_cache['id_index'] = None
+        _ledger_cache['tombstones'] = 0
+        if SNAPSHOT_FORMAT == 'binary':
+            # Serve from the new file rather than keeping the decoded rows;
+            # positions are the same
+            with open(DATA_FILE, 'rb') as f:
+                live = Snapshot(f).entries()
+        _ledger_cache['data'] = live
+        if fresh:
+            _ledger_cache['aggregates'] = build_aggregates(live)
+            _ledger_cache['day_totals'] = None
+        _ledger_cache['signature'] = file_signature(DATA_FILE)
+        _ledger_cache['snapshot_path'] = DATA_FILE
+        _ledger_cache['generation'] = generation
+        if JOURNAL_MODE:
+            _reset_journal()
+        save_aggregates()
+
+@timed('load_data')
 def load_data():
+    with _ledger_lock:
+        snapshot = file_signature(_ledger_cache['snapshot_path'])
+        journal = file_signature(JOURNAL_FILE) if JOURNAL_MODE else None
+        journal_ino = journal[0] if journal else None
+        if (_ledger_cache['data'] is not None and snapshot == _ledger_cache['signature']
+                and journal_ino == _ledger_cache['journal_ino']):
+            if (LEDGER_PARTITIONS != 'off' and _write_lock['owner'] != threading.get_ident()
+                    and load_manifest()['sealed_generation'] > _ledger_cache['generation']):
+                # Another worker has sealed partitions out of the ledger
+                # cached here and is about to replace the snapshot; wait for
+                # it so sealed entries are never counted in both
+                _finish_seal()
+                return _ledger_cache['data']
+            if journal is None or journal[1] == _ledger_cache['journal_offset']:
+                cache_stats['hits'] += 1
+                return _ledger_cache['data']
+            if journal[1] > _ledger_cache['journal_offset']:
+                # Only the journal grew: replay just the new records
+                if _replay_journal(_ledger_cache['data']):
+                    cache_stats['replays'] += 1
+                    return _ledger_cache['data']
+
+        cache_stats['misses'] += 1
+        while True:
+            data = _load_snapshot()
+            if JOURNAL_MODE:
+                _replay_journal(data)
+            # A newer journal means a compaction replaced both files while we
+            # were reading them; start over from the new snapshot
+            if _ledger_cache['journal_generation'] <= _ledger_cache['generation']:
+                break
+
+        _ledger_cache['aggregates'] = _read_aggregates()
+        if _ledger_cache['aggregates'] is None:
+            _ledger_cache['aggregates'] = build_aggregates(data)
+            save_aggregates()
+
+        if any(
+            'id' not in entry
+            for kind in ('income', 'expenses') if not isinstance(data[kind], SnapshotEntries)
+            for entry in data[kind] if entry is not None
+        ):
+            _assign_missing_ids()
+        if _ledger_cache['snapshot_path'] != DATA_FILE:
+            # Loaded a snapshot in the other format: convert it, unless
+            # another worker got there first
+            with ledger_write_lock():
+                if not os.path.exists(DATA_FILE):
+                    save_data(data)
+        elif LEDGER_PARTITIONS != 'off' and load_manifest()['sealed_generation'] > _ledger_cache['generation']:
+            _finish_seal()
+        return _ledger_cache['data']
+
+def _finish_seal():
+    # A seal wrote its partitions but not the live snapshot without the
+    # sealed entries (or is doing so right now in another worker); compact
+    # again, which drops the entries already sealed
+    with ledger_write_lock():
+        data = load_data()
+        if load_manifest()['sealed_generation'] > _ledger_cache['generation']:
+            save_data(data)
+
+def _load_snapshot():
+    # DATA_FILE, or failing that a snapshot in the other format
+    signature = None
+    data = {'income': [], 'expenses': []}
+    loaded = DATA_FILE
+    for path in sorted(SNAPSHOT_FILES.values(), key=lambda path: path != DATA_FILE):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            continue
+        loaded = path
+        with f:
+            signature = os.fstat(f.fileno())
+            if path == SNAPSHOT_FILES['binary']:
+                snapshot = Snapshot(f)
+                data = dict(snapshot.entries(), generation=snapshot.generation)
+            else:
+                # Entries are converted as they are parsed, so the parsed
+                # dicts never all exist at once
+                data = json.load(f, object_hook=ledger_entry)
+        break
+    if signature is not None:
+        signature = (signature.st_ino, signature.st_size, signature.st_mtime_ns)
+    _ledger_cache['signature'] = signature
+    _ledger_cache['snapshot_path'] = loaded
+    _ledger_cache['data'] = data
+    _ledger_cache['generation'] = data.pop('generation', 0)
+    _ledger_cache['journal_ino'] = None
+    _ledger_cache['journal_offset'] = 0
+    _ledger_cache['journal_records'] = 0
+    _ledger_cache['journal_stale'] = False
+    _ledger_cache['journal_generation'] = _ledger_cache['generation']
+    _ledger_cache['aggregates'] = None
+    _ledger_cache['day_totals'] = None
+    _ledger_cache['date_index'] = None
+    _ledger_cache['search_index'] = None
+    _ledger_cache['listing_indexes'] = None
+    _ledger_cache['id_index'] = None
+    _ledger_cache['tombstones'] = 0
+    return data
+
+def new_entry_id():
+    return uuid.uuid4().hex[:16]
+
+def _assign_missing_ids():
+    # Entries written before IDs existed get one, persisted by a compaction
+    with ledger_write_lock():
+        data = load_data()
+        assigned = 0
+        for kind in ('income', 'expenses'):
+            for entry in data[kind]:
+                if entry is not None and 'id' not in entry:
+                    entry['id'] = new_entry_id()
+                    assigned += 1
+        if assigned:
+            _ledger_cache['id_index'] = None
+            save_data(data)
+
+def build_id_index(data):
+    # id -> (kind, ledger position)
+    id_index = {}
+    for kind in ('income', 'expenses'):
+        first = indexed_positions(data[kind])
+        for position, entry_id in enumerate(column_values(data[kind], 'id', first), first):
+            if entry_id is not None:
+                id_index[entry_id] = (kind, position)
+    if any(indexed_positions(data[kind]) for kind in ('income', 'expenses')):
+        id_index = SnapshotIdIndex(data, id_index)
+    return id_index
+
+def _id_index(data):
+    # Built on first use and kept up to date
+    if _ledger_cache['id_index'] is None:
+        _ledger_cache['id_index'] = build_id_index(data)
+    return _ledger_cache['id_index']
+
+class SnapshotIdIndex:
+    # The ID index over a binary snapshot: rows written since the snapshot
+    # are in a dict, the rest are found on the snapshot's by_id index
+    def __init__(self, data, recent):
+        self.data = data
+        self.recent = recent
+
+    def get(self, entry_id, default=None):
+        if entry_id in self.recent:
+            return self.recent[entry_id]
+        for kind in ('income', 'expenses'):
+            if indexed_positions(self.data[kind]):
+                position = self.data[kind].find_id(entry_id)
+                if position is not None:
+                    return (kind, position)
+        return default
+
+    def __contains__(self, entry_id):
+        return self.get(entry_id) is not None
+
+    def __getitem__(self, entry_id):
+        location = self.get(entry_id)
+        if location is None:
+            raise KeyError(entry_id)
+        return location
+
+    def __setitem__(self, entry_id, location):
+        self.recent[entry_id] = location
+
+    def pop(self, entry_id, default=None):
+        # Snapshot rows drop out once their slot is tombstoned
+        location = self.get(entry_id, default)
+        self.recent.pop(entry_id, None)
+        return location
+
+def _apply_record(data, record):
+    aggregates = _ledger_cache['aggregates']
+    day_totals = _ledger_cache['day_totals']
+    if record['op'] == 'add':
+        kind = record['kind']
+        entries = data[kind]
+        entry = ledger_entry(record['entry'])
+        entries.append(entry)
+        if aggregates is not None:
+            _update_aggregates(aggregates, kind, entry, 1)
+        if day_totals is not None:
+            _count_day(day_totals[kind], entry['date'], entry['category'], entry_value(entry, 'cents'), 1)
+        if _ledger_cache['date_index'] is not None:
+            _index_date(_ledger_cache['date_index'], kind, len(entries) - 1, entry)
+        if _ledger_cache['search_index'] is not None:
+            _ledger_cache['search_index'][kind].add(entries, len(entries) - 1)
+        if _ledger_cache['listing_indexes'] is not None:
+            _index_listing(_ledger_cache['listing_indexes'], kind, len(entries) - 1, entry)
+        if _ledger_cache['id_index'] is not None and 'id' in entry:
+            _ledger_cache['id_index'][entry['id']] = (kind, len(entries) - 1)
+    elif record['op'] == 'delete' and 'id' in record:
+        # The slot becomes a tombstone so no other position moves;
+        # compaction drops it later
+        location = _id_index(data).pop(record['id'], None)
+        if location is None:
+            return
+        kind, position = location
+        entry = data[kind][position]
+        data[kind][position] = None
+        _ledger_cache['tombstones'] += 1
+        if aggregates is not None:
+            _update_aggregates(aggregates, kind, entry, -1)
+        if day_totals is not None:
+            _count_day(day_totals[kind], entry['date'], entry['category'], entry_value(entry, 'cents'), -1)
+    elif record['op'] == 'delete':
+        # Journals written before IDs delete by list position
+        entries = data[record['kind']]
+        if 0 <= record['index'] < len(entries):
+            entry = entries.pop(record['index'])
+            if aggregates is not None:
+                _update_aggregates(aggregates, record['kind'], entry, -1)
+            if day_totals is not None:
+                _count_day(day_totals[record['kind']], entry['date'], entry['category'], entry_value(entry, 'cents'), -1)
+            _ledger_cache['date_index'] = None
+            _ledger_cache['search_index'] = None
+            _ledger_cache['listing_indexes'] = None
+            _ledger_cache['id_index'] = None
+
+def _apply_records(data, records):
+    # A record that fails may be half applied: the cached ledger is dropped
+    # so the next load_data() starts over from the files
+    try:
+        for record in records:
+            _apply_record(data, record)
+    except Exception:
+        _ledger_cache['data'] = None
+        raise
+
+def _replay_journal(data):
+    # Returns False if the journal was swapped out since it was last read
+    offset = _ledger_cache['journal_offset']
+    try:
+        f = open(JOURNAL_FILE, 'rb')
+    except FileNotFoundError:
+        return offset == 0
+    with f:
+        journal_ino = os.fstat(f.fileno()).st_ino
+        if offset and journal_ino != _ledger_cache['journal_ino']:
+            return False
+        _ledger_cache['journal_ino'] = journal_ino
+        f.seek(offset)
+        for line in f:
+            # A torn trailing line is left for the next read
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            record = json.loads(line)
+            if 'generation' in record:
+                # A journal left over from an interrupted compaction is
+                # already part of the snapshot
+                _ledger_cache['journal_generation'] = record['generation']
+                if record['generation'] != _ledger_cache['generation']:
+                    _ledger_cache['journal_stale'] = True
+            elif not _ledger_cache['journal_stale']:
+                _apply_records(data, [record])
+                _ledger_cache['journal_records'] += 1
+            # Advanced record by record, so a failure part way through never
+            # has the records before it applied again
+            _ledger_cache['journal_offset'] = offset
+    return True
+
+def _reset_journal():
+    header = json.dumps({'generation': _ledger_cache['generation']}) + '\n'
+    write_file_atomic(JOURNAL_FILE, lambda f: f.write(header))
+    _ledger_cache['journal_ino'] = file_signature(JOURNAL_FILE)[0]
+    _ledger_cache['journal_offset'] = len(header)
+    _ledger_cache['journal_records'] = 0
+    _ledger_cache['journal_stale'] = False
+    _ledger_cache['journal_generation'] = _ledger_cache['generation']
+
+def _journal_append(records):
+    if _ledger_cache['journal_ino'] is None or _ledger_cache['journal_stale']:
+        _reset_journal()
+    payload = ''.join(json.dumps(record) + '\n' for record in records).encode()
+    fd = os.open(JOURNAL_FILE, os.O_WRONLY | os.O_APPEND)
+    try:
+        if os.fstat(fd).st_size > _ledger_cache['journal_offset']:
+            # A torn last line from a writer that died mid-append (load_data()
+            # has just read every whole line); records appended after it
+            # would be unreadable
+            os.ftruncate(fd, _ledger_cache['journal_offset'])
+        os.write(fd, payload)
+        _journal_sync['pending'] += len(records)
+        if (_journal_sync['pending'] >= JOURNAL_FSYNC_EVERY
+                or time.monotonic() - _journal_sync['last'] >= JOURNAL_FSYNC_INTERVAL):
+            os.fsync(fd)
+            _journal_sync['pending'] = 0
+            _journal_sync['last'] = time.monotonic()
+        elif _journal_sync['timer'] is None:
+            # The next append may be a long way off, so sync these on time anyway
+            timer = threading.Timer(JOURNAL_FSYNC_INTERVAL, sync_journal)
+            timer.daemon = True
+            _journal_sync['timer'] = timer
+            timer.start()
+    finally:
+        os.close(fd)
+    _ledger_cache['journal_offset'] += len(payload)
+    _ledger_cache['journal_records'] += len(records)
+
+@atexit.register
+def sync_journal():
+    with _ledger_lock:
+        _journal_sync['timer'] = None
+        if JOURNAL_MODE and _journal_sync['pending'] and os.path.exists(JOURNAL_FILE):
+            fd = os.open(JOURNAL_FILE, os.O_WRONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            _journal_sync['pending'] = 0
+            _journal_sync['last'] = time.monotonic()
+
+def compact_data():
+    # Writers wait throughout, so the cached ledger can't change, but the
+    # new snapshot is written with _ledger_lock let go: this worker's
+    # readers go on being served from the cache until it is swapped. A
+    # compaction that seals entries into partitions is done whole under the
+    # lock, as readers would otherwise count them in both places.
+    try:
+        with ledger_writer():
+            with _ledger_lock:
+                data = load_data()
+                if _ledger_cache['aggregates'] is None or _seal_due():
+                    save_data(data)
+                    return
+                generation = _ledger_cache['generation'] + 1
+            live = {kind: [entry for entry in data[kind] if entry is not None] for kind in ('income', 'expenses')}
+            _install_snapshot(_write_snapshot_file(live, generation), live, generation, False)
+    finally:
+        # Also after a failed compaction, so the next write tries again
+        _compacting.clear()
+
+def _seal_due():
+    # Whether the live ledger holds entries due to be sealed, or entries a
+    # seal that did not finish has already written to partitions
+    if LEDGER_PARTITIONS == 'off':
+        return False
+    opening = open_period()
+    return (any(month[:PARTITION_LENGTH] < opening for month in _ledger_cache['aggregates']['months'])
+            or load_manifest()['sealed_generation'] > _ledger_cache['generation'])
+
+def _maybe_compact():
+    # Also as soon as the live ledger holds entries due to be sealed
+    if (_ledger_cache['journal_records'] >= JOURNAL_COMPACT_AT or _seal_due()) and not _compacting.is_set():
+        _compacting.set()
+        threading.Thread(target=compact_data, daemon=True).start()
+
+@timed('save')
+def write_records(records):
+    # Applies a batch of add/delete records as one write under the ledger lock.
+    # load_data() first picks up anything other workers wrote meanwhile.
+    for record in records:
+        if record['op'] == 'add':
+            record['entry'].setdefault('id', new_entry_id())
+    with ledger_write_lock():
+        data = load_data()
+        if len(records) > INDEX_REBUILD_BATCH:
+            _ledger_cache['date_index'] = None
+            _ledger_cache['search_index'] = None
+            _ledger_cache['listing_indexes'] = None
+        if JOURNAL_MODE:
+            _journal_append(records)
+            _apply_records(data, records)
+            save_aggregates()
+            _maybe_compact()
+        else:
+            _apply_records(data, records)
+            save_data(data)
+        for record in records:
+            write_stats[record['op']] += 1
+
+def add_entry(kind, entry):
+    write_records([{'op': 'add', 'kind': kind, 'entry': entry}])
+
+def delete_ids(ids, kind=None):
+    # Deletes entries by ID in one write and returns the IDs actually deleted
+    with ledger_write_lock():
+        id_index = _id_index(load_data())
+        requested = list(dict.fromkeys(ids))
+        found = [
+            entry_id for entry_id in requested
+            if entry_id in id_index and (kind is None or id_index[entry_id][0] == kind)
+        ]
+        if found:
+            write_records([{'op': 'delete', 'id': entry_id} for entry_id in found])
+        if len(found) < len(requested) and load_manifest()['partitions']:
+            deleted = set(found)
+            deleted.update(delete_sealed([entry_id for entry_id in requested if entry_id not in deleted], kind))
+            found = [entry_id for entry_id in requested if entry_id in deleted]
+        return found
+
+def delete_entry(kind, index):
+    # Deletes by position among live entries, for pages rendered before IDs
+    with ledger_write_lock():
+        ledgers = [partition.entries[kind] for partition in sealed_partitions()] + [load_data()[kind]]
+        live = [entry_id for entries in ledgers for entry_id in column_values(entries, 'id') if entry_id is not None]
+        if not 0 <= index < len(live):
+            return False
+        return bool(delete_ids([live[index]], kind))
+
+# Aggregates: grand totals, per-month totals and per-month-per-category totals,
+# all amounts in integer cents. Adds and deletes adjust them in place, so
+# reports never rescan the ledger.
+def _new_aggregates():
+    return {
+        'totals': {'income': 0, 'expenses': 0},
+        'months': {},
+        'categories': {}
+    }
+
+def _update_aggregates(aggregates, kind, entry, sign):
+    _count_entry(aggregates, kind, entry['date'], entry['category'], entry_value(entry, 'cents'), sign)
+
+def _count_entry(aggregates, kind, date, category_name, cents, sign):
+    cents *= sign
+    month = date[:7]
+    aggregates['totals'][kind] += cents
+
+    month_totals = aggregates['months'].setdefault(month, {'income': 0, 'expenses': 0, 'count': 0})
+    month_totals[kind] += cents
+    month_totals['count'] += sign
+
+    categories = aggregates['categories'].setdefault(month, {'income': {}, 'expenses': {}})[kind]
+    category = categories.setdefault(category_name, {'amount': 0, 'count': 0})
+    category['amount'] += cents
+    category['count'] += sign
+
+    # Drop buckets that no longer hold any entries, as a rescan would
+    if category['count'] <= 0:
+        del categories[category_name]
+    if month_totals['count'] <= 0:
+        del aggregates['months'][month]
+        del aggregates['categories'][month]
+
+def aggregates_in_cents(aggregates):
+    # Aggregates stored before amounts were kept in cents: euro amounts
+    # rounded to the cent, so this is exact
+    for kind in ('income', 'expenses'):
+        aggregates['totals'][kind] = to_cents(aggregates['totals'][kind])
+    for totals in aggregates['months'].values():
+        for kind in ('income', 'expenses'):
+            totals[kind] = to_cents(totals[kind])
+    for kinds in aggregates['categories'].values():
+        for categories in kinds.values():
+            for stats in categories.values():
+                stats['amount'] = to_cents(stats['amount'])
+    return aggregates
+
+def build_aggregates(data):
+    if COLUMNAR_STORE:
+        return ColumnarLedger.from_data(data).aggregates()
+
+    aggregates = _new_aggregates()
+    for kind in ('income', 'expenses'):
+        rows = zip(*(column_values(data[kind], name) for name in ('date', 'cents', 'category')))
+        for date, cents, category in rows:
+            if date is not None:
+                _count_entry(aggregates, kind, date, category, cents, 1)
+    return aggregates
+
+def _ledger_stamp():
+    # Identifies the ledger state the aggregates were computed from
+    return [_ledger_cache['generation'], _ledger_cache['journal_offset']]
+
+def _read_aggregates():
+    try:
+        with open(AGGREGATES_FILE, 'r') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stored.get('stamp') != _ledger_stamp() or not stored.get('cents'):
+        return None
+    return stored['aggregates']
+
+def save_aggregates():
+    stored = {'stamp': _ledger_stamp(), 'cents': True, 'aggregates': _ledger_cache['aggregates']}
+    write_file_atomic(AGGREGATES_FILE, lambda f: json.dump(stored, f))
+
+def load_aggregates():
+    # The live ledger's aggregates plus those stored for sealed partitions
+    with _ledger_lock:
+        load_data()
+        if not load_manifest()['partitions']:
+            return _ledger_cache['aggregates']
+        key = (_partitions['signature'], _ledger_cache['generation'], _ledger_cache['journal_offset'])
+        if _partitions['merged_key'] != key:
+            _partitions['merged'] = merge_aggregates([_partitions['aggregates'], _ledger_cache['aggregates']])
+            _partitions['merged_key'] = key
+        return _partitions['merged']
+
+@timed('aggregation')
+def range_totals(start='', end=''):
+    # Totals for dates from start to end inclusive; either bound may be a
+    # 'YYYY' or 'YYYY-MM' prefix or left empty
+    if len(start) <= 7 and len(end) <= 7:
+        # Whole months: answered from the monthly aggregates
+        income = 0
+        expenses = 0
+        for month, totals in load_aggregates()['months'].items():
+            if in_date_range(month, start, end):
+                income += totals['income']
+                expenses += totals['expenses']
+        return from_cents(income), from_cents(expenses)
+
+    income = sum(cents for cents, in iter_fields('income', ('cents',), start, end))
+    expenses = sum(cents for cents, in iter_fields('expenses', ('cents',), start, end))
+    return from_cents(income), from_cents(expenses)
+
+# Columnar copy of the ledger, built when aggregates are: amounts as int64
+# cents and categories/months as dictionary-encoded codes, so the
+# aggregates are vectorized group-bys instead of per-row dict access.
+# Needs NumPy.
+class ColumnTable:
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.amounts = np.zeros(capacity, dtype=np.int64)
+        self.months = np.zeros(capacity, dtype=np.int32)
+        self.categories = np.zeros(capacity, dtype=np.int32)
+
+    def _columns(self):
+        return ('amounts', 'months', 'categories')
+
+    def append(self, amount, month, category):
+        if self.size == len(self.amounts):
+            for name in self._columns():
+                column = getattr(self, name)
+                grown = np.zeros(len(column) * 2, dtype=column.dtype)
+                grown[:self.size] = column
+                setattr(self, name, grown)
+        i = self.size
+        self.amounts[i] = amount
+        self.months[i] = month
+        self.categories[i] = category
+        self.size += 1
+
+    def view(self, name):
+        return getattr(self, name)[:self.size]
+
+class ColumnarLedger:
+    def __init__(self):
+        self.tables = {'income': ColumnTable(), 'expenses': ColumnTable()}
+        self.month_names = []
+        self.category_names = []
+        self._codes = {'month': {}, 'category': {}}
+
+    @classmethod
+    def from_data(cls, data):
+        ledger = cls()
+        for kind in ('income', 'expenses'):
+            rows = zip(*(column_values(data[kind], name) for name in ('date', 'cents', 'category')))
+            for date, cents, category in rows:
+                if date is not None:
+                    ledger.append(kind, date, cents, category)
+        return ledger
+
+    def _encode(self, table, names, value):
+        codes = self._codes[table]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def append(self, kind, date, cents, category):
+        self.tables[kind].append(
+            cents,
+            self._encode('month', self.month_names, date[:7]),
+            self._encode('category', self.category_names, category)
+        )
+
+    def aggregates(self):
+        # Same shape as build_aggregates(), computed with bincount group-bys.
+        # bincount sums in float64, which is exact for whole cents below 2**53.
+        aggregates = _new_aggregates()
+        n_months = len(self.month_names)
+        n_categories = len(self.category_names)
+        month_sums = {}
+        month_counts = {}
+        for kind, table in self.tables.items():
+            amounts = table.view('amounts')
+            months = table.view('months')
+            aggregates['totals'][kind] = int(amounts.sum())
+            month_sums[kind] = np.bincount(months, weights=amounts, minlength=n_months).round().astype(np.int64)
+            month_counts[kind] = np.bincount(months, minlength=n_months)
+
+        for code in np.flatnonzero(month_counts['income'] + month_counts['expenses']):
+            aggregates['months'][self.month_names[code]] = {
+                'income': int(month_sums['income'][code]),
+                'expenses': int(month_sums['expenses'][code]),
+                'count': int(month_counts['income'][code] + month_counts['expenses'][code])
+            }
+            aggregates['categories'][self.month_names[code]] = {'income': {}, 'expenses': {}}
+
+        for kind, table in self.tables.items():
+            keys = table.view('months').astype(np.int64) * max(n_categories, 1) + table.view('categories')
+            groups, inverse = np.unique(keys, return_inverse=True)
+            sums = np.bincount(inverse, weights=table.view('amounts'), minlength=len(groups)).round().astype(np.int64)
+            counts = np.bincount(inverse, minlength=len(groups))
+            for key, amount, count in zip(groups.tolist(), sums.tolist(), counts.tolist()):
+                month, category = divmod(key, max(n_categories, 1))
+                aggregates['categories'][self.month_names[month]][kind][self.category_names[category]] = {
+                    'amount': amount,
+                    'count': count
+                }
+        return aggregates
+
+# Upper bound that sorts after every date starting with a given prefix
+DATE_PREFIX_END = '\uffff'
+
+def in_date_range(date, start='', end=''):
+    return (not start or date >= start) and (not end or date <= end + DATE_PREFIX_END)
+
+# Date index: per kind, entry dates in sorted order with their ledger
+# positions alongside, so date-range reads are a bisect plus the matches
+def _index_date(date_index, kind, position, entry):
+    dates, positions = date_index[kind]
+    i = bisect.bisect_right(dates, entry['date'])
+    dates.insert(i, entry['date'])
+    positions.insert(i, position)
+
+def build_date_index(entries):
+    # Positions not covered by a snapshot's own by_date index
+    first = indexed_positions(entries)
+    dates = column_values(entries, 'date', first)
+    order = sorted((position for position, date in enumerate(dates) if date is not None), key=dates.__getitem__)
+    return [dates[position] for position in order], [first + position for position in order]
+
+def load_date_index():
+    with _ledger_lock:
+        data = load_data()
+        if _ledger_cache['date_index'] is None:
+            _ledger_cache['date_index'] = {kind: build_date_index(data[kind]) for kind in ('income', 'expenses')}
+        return _ledger_cache['date_index']
+
+def range_positions(entries, date_index, start, end):
+    # Positions of one ledger list dated start..end (inclusive, either
+    # bound may be a date prefix) in date order
+    dates, positions = date_index
+    lo = bisect.bisect_left(dates, start) if start else 0
+    hi = bisect.bisect_right(dates, end + DATE_PREFIX_END) if end else len(dates)
+    if not indexed_positions(entries):
+        return positions[lo:hi]
+    # Snapshot rows from its by_date index, then merged with the rows
+    # added since (earlier rows first among equal dates)
+    shared = entries.date_positions(start, end)
+    if lo == hi:
+        return shared
+    merged = heapq.merge(
+        ((entries._field('date', position), position) for position in shared),
+        zip(dates[lo:hi], positions[lo:hi]),
+        key=lambda pair: pair[0]
+    )
+    return [position for _, position in merged]
+
+def _range_positions(kind, start, end):
+    with _ledger_lock:
+        return range_positions(load_data()[kind], load_date_index()[kind], start, end)
+
+def _ledger_slots(kind, start, end):
+    # (entries, position) for every slot of one kind, sealed partitions
+    # first: in ledger order, or dated start..end in date order. The live
+    # ledger is loaded before the manifest is read, under the lock, so a
+    # seal finishing in between cannot hide the entries it moved.
+    with _ledger_lock:
+        live = load_data()[kind]
+        sources = [
+            (partition.entries[kind], partition.range_positions(kind, start, end) if start or end else None)
+            for partition in sealed_partitions(start, end)
+        ]
+        sources.append((live, _range_positions(kind, start, end) if start or end else None))
+    if not (start or end) or len(sources) == 1:
+        for entries, positions in sources:
+            for position in range(len(entries)) if positions is None else positions:
+                yield entries, position
+        return
+
+    def dated(entries, positions):
+        for position in positions:
+            fields = entry_fields(entries, position, ('date',))
+            if fields is not None:
+                yield fields[0], entries, position
+
+    merged = heapq.merge(*(dated(entries, positions) for entries, positions in sources), key=lambda slot: slot[0])
+    for _, entries, position in merged:
+        yield entries, position
+
+def iter_entries(kind, start='', end=''):
+    # All entries of one kind in ledger order, or those dated start..end
+    # in date order
+    for entries, position in _ledger_slots(kind, start, end):
+        if entries[position] is not None:
+            yield entries[position]
+
+def iter_fields(kind, names, start='', end=''):
+    # Like iter_entries, but yields tuples of just the named fields, which
+    # for a binary snapshot leaves the other columns untouched
+    for entries, position in _ledger_slots(kind, start, end):
+        fields = entry_fields(entries, position, names)
+        if fields is not None:
+            yield fields
+
+# Listing indexes for /api/transactions: per kind, sort field and (optional)
+# category, (sort value, id) keys in sorted order with ledger positions
+# alongside. A page is a bisect to the cursor plus a walk of `limit` slots.
+LISTING_SORTS = {'date': str, 'amount': float}
+
+def _listing_key(sort, entry):
+    return (LISTING_SORTS[sort](entry[sort]), entry.get('id', ''))
+
+def _index_listing(listing_indexes, kind, position, entry):
+    for (index_kind, sort, category), (keys, positions) in listing_indexes.items():
+        if index_kind == kind and category in (None, entry['category']):
+            key = _listing_key(sort, entry)
+            i = bisect.bisect_right(keys, key)
+            keys.insert(i, key)
+            positions.insert(i, position)
+
+def build_listing_index(entries, sort, category=None):
+    values = column_values(entries, sort)
+    ids = column_values(entries, 'id')
+    categories = column_values(entries, 'category') if category is not None else None
+    keyed = sorted(
+        ((LISTING_SORTS[sort](value), entry_id or ''), position)
+        for position, (value, entry_id) in enumerate(zip(values, ids))
+        if value is not None and (category is None or categories[position] == category)
+    )
+    return [key for key, _ in keyed], [position for _, position in keyed]
+
+def load_listing_index(kind, sort, category=None):
+    with _ledger_lock:
+        data = load_data()
+        if _ledger_cache['listing_indexes'] is None:
+            _ledger_cache['listing_indexes'] = {}
+        listing_indexes = _ledger_cache['listing_indexes']
+        if (kind, sort, category) not in listing_indexes:
+            listing_indexes[(kind, sort, category)] = build_listing_index(data[kind], sort, category)
+        return listing_indexes[(kind, sort, category)]
+
+def _walk_listing(entries, listing_index, kind, sort, descending, start, end, after):
+    # Yields (key, kind, entry) from one listing index, in order, past `after`
+    keys, positions = listing_index
+    lo, hi = 0, len(keys)
+    if sort == 'date':
+        if start:
+            lo = bisect.bisect_left(keys, (start,))
+        if end:
+            hi = bisect.bisect_right(keys, (end + DATE_PREFIX_END,))
+    if after is not None:
+        if descending:
+            hi = min(hi, bisect.bisect_left(keys, after))
+        else:
+            lo = max(lo, bisect.bisect_right(keys, after))
+    for i in (range(hi - 1, lo - 1, -1) if descending else range(lo, hi)):
+        entry = entries[positions[i]]
+        if entry is None or (sort != 'date' and not in_date_range(entry['date'], start, end)):
+            continue
+        yield keys[i], kind, entry
+
+@timed('aggregation')
+def list_entries(kinds, sort='date', descending=True, start='', end='', category=None, after=None, limit=LIST_DEFAULT_LIMIT):
+    # One page of entries ordered by (sort value, id) and strictly past the
+    # cursor key `after`, as (key, kind, entry) tuples. Walked under the
+    # ledger lock since writers insert into the same index lists.
+    with _ledger_lock:
+        walks = [
+            _walk_listing(load_data()[kind], load_listing_index(kind, sort, category),
+                          kind, sort, descending, start, end, after)
+            for kind in kinds
+        ]
+        for partition in sealed_partitions(start, end):
+            walks.extend(
+                _walk_listing(partition.entries[kind], partition.listing_index(kind, sort, category),
+                              kind, sort, descending, start, end, after)
+                for kind in kinds
+            )
+        merged = heapq.merge(*walks, key=lambda item: item[0], reverse=descending)
+        return list(itertools.islice(merged, limit))
+
+# Search index for /api/search: per kind, an inverted index from the words
+# of descriptions to the ledger positions using them. Each word's positions
+# are kept in (date, id) order, with their dates alongside as YYYYMMDD
+# numbers, so a date range is a bisect and results come out newest first
+# without sorting; the words are kept sorted so a prefix is a bisect too,
+# and each word's categories are kept so category filters can pass over
+# it. Adds insert into it; tombstones are skipped when walking.
+SEARCH_WORD = re.compile(r'\w+')
+
+def search_terms(text):
+    return SEARCH_WORD.findall(text.lower())
+
+def date_number(date, fill='0'):
+    # A 'YYYY-MM-DD' date, or a 'YYYY'/'YYYY-MM' prefix padded with fill,
+    # as the number YYYYMMDD
+    digits = date[:4] + date[5:7] + date[8:10]
+    if len(date) not in (4, 7, 10) or not digits.isdigit():
+        raise ValueError(f'invalid date: {date}')
+    return int(digits.ljust(8, fill))
+
+def _indexed_date_number(date):
+    # None for a stored date date_number can't read (older ledgers accepted
+    # any date from the forms); such entries are left out of the index
+    try:
+        return date_number(date)
+    except (TypeError, ValueError):
+        return None
+
+class SearchIndex:
+    def __init__(self, entries):
+        self.postings = {}
+        self.categories = defaultdict(set)
+        dates = column_values(entries, 'date')
+        ids = column_values(entries, 'id')
+        descriptions = column_values(entries, 'description')
+        categories = column_values(entries, 'category')
+        # Each distinct date and description is converted once
+        numbers = {date: _indexed_date_number(date) for date in set(dates) if date is not None}
+        order = sorted(
+            (position for position, date in enumerate(dates) if date is not None and numbers[date] is not None),
+            key=lambda position: (dates[position], ids[position] or '')
+        )
+        words_of = {}
+        for position in order:
+            date, description = dates[position], descriptions[position]
+            number = numbers[date]
+            words = words_of.get(description)
+            if words is None:
+                words = words_of[description] = set(search_terms(description))
+            for word in words:
+                posting = self.postings.get(word)
+                if posting is None:
+                    posting = self.postings[word] = (array('I'), array('I'))
+                posting[0].append(number)
+                posting[1].append(position)
+                self.categories[word].add(categories[position])
+        self.words = sorted(self.postings)
+
+    def add(self, entries, position):
+        date, entry_id, description, category = entry_fields(entries, position, ('date', 'id', 'description', 'category'))
+        number = _indexed_date_number(date)
+        if number is None:
+            return
+        for word in set(search_terms(description)):
+            if word not in self.postings:
+                bisect.insort(self.words, word)
+                self.postings[word] = (array('I'), array('I'))
+            self.categories[word].add(category)
+            numbers, positions = self.postings[word]
+            # After the word's entries on earlier dates and on the same date
+            # with lower IDs
+            i = bisect.bisect_left(numbers, number)
+            last = bisect.bisect_right(numbers, number, i)
+            while i < last:
+                fields = entry_fields(entries, positions[i], ('id',))
+                if fields is not None and (fields[0] or '') > (entry_id or ''):
+                    break
+                i += 1
+            numbers.insert(i, number)
+            positions.insert(i, position)
+
+    def matching(self, term, categories=frozenset()):
+        # The words starting with term, less those never used in any of the
+        # categories
+        i = bisect.bisect_left(self.words, term)
+        words = []
+        while i < len(self.words) and self.words[i].startswith(term):
+            if not categories or not categories.isdisjoint(self.categories[self.words[i]]):
+                words.append(self.words[i])
+            i += 1
+        return words
+
+    def owners(self, term):
+        # {position: the word term is scored against there} for every
+        # position with a word starting with term; the best word goes last
+        owners = {}
+        for word in sorted(self.matching(term), key=lambda word: (len(word), word), reverse=True):
+            owners.update(dict.fromkeys(self.postings[word][1], word))
+        return owners
+
+def load_search_index(kind):
+    # Built for both kinds at once, since adds update whichever kind they go to
+    with _ledger_lock:
+        data = load_data()
+        if _ledger_cache['search_index'] is None:
+            _ledger_cache['search_index'] = {kind: SearchIndex(data[kind]) for kind in ('income', 'expenses')}
+        return _ledger_cache['search_index'][kind]
+
+def _walk_word(entries, search_index, kind, word, score, members, low, high, categories, after):
+    # Yields (key, kind, entry) for the entries using one word and, when
+    # members are given, whose positions are in each of them; newest first
+    # and past `after`, every key with the same score
+    numbers, positions = search_index.postings[word]
+    lo, hi = bisect.bisect_left(numbers, low), bisect.bisect_right(numbers, high)
+    if after is not None:
+        if score > after[0]:
+            return
+        if score == after[0]:
+            hi = min(hi, bisect.bisect_right(numbers, date_number(after[1])))
+    for i in range(hi - 1, lo - 1, -1):
+        position = positions[i]
+        if any(position not in positions_of for positions_of in members):
+            continue
+        entry = entries[position]
+        if entry is None or (categories and entry['category'] not in categories):
+            continue
+        key = (score, entry['date'], entry.get('id') or '')
+        if after is not None and key >= after:
+            continue
+        yield key, kind, entry
+
+def _walk_ranked(entries, search_index, kind, terms, low, high, categories, after):
+    # Yields (key, kind, entry) for entries matching every one of several
+    # search terms, best first and past `after`. The positions of the term
+    # with the fewest matches are scored and ranked whole, in date order
+    # from its postings; only entries sharing a score and date need their
+    # IDs read to be ordered.
+    owners = [search_index.owners(term) for term in terms]
+    lead = min(range(len(terms)), key=lambda t: len(owners[t]))
+    ranked = []
+    for word in search_index.matching(terms[lead]):
+        numbers, positions = search_index.postings[word]
+        for i in range(bisect.bisect_left(numbers, low), bisect.bisect_right(numbers, high)):
+            position = positions[i]
+            if owners[lead][position] != word:
+                continue
+            score = 0
+            for term, term_owners in zip(terms, owners):
+                matched = term_owners.get(position)
+                if matched is None:
+                    break
+                score += len(term) / len(matched)
+            else:
+                ranked.append((score, numbers[i], position))
+    ranked.sort()
+    if after is not None:
+        ranked = ranked[:bisect.bisect_right(ranked, (after[0], date_number(after[1]), float('inf')))]
+    for _, run in itertools.groupby(reversed(ranked), key=lambda item: item[:2]):
+        found = []
+        for score, _, position in run:
+            entry = entries[position]
+            if entry is None or (categories and entry['category'] not in categories):
+                continue
+            key = (score, entry['date'], entry.get('id') or '')
+            if after is None or key < after:
+                found.append((key, kind, entry))
+        found.sort(key=lambda item: item[0], reverse=True)
+        yield from found
+
+def _best_matches(merged, term):
+    # An entry with several words starting with term is walked once per
+    # word; keeps it from its best (shortest) word, which comes first
+    previous = None
+    for item in merged:
+        key, _, entry = item
+        shortest = min(len(word) for word in search_terms(entry['description']) if word.startswith(term))
+        if key[0] != len(term) / shortest or (previous is not None and previous[0] == key and previous[2] == entry):
+            continue
+        previous = item
+        yield item
+
+def _search_walks(entries, search_index, kind, terms, low, high, categories, after):
+    matches = [search_index.matching(term, categories) for term in terms]
+    if len(terms) == 1:
+        # A walk per word, scored by how much of it the term matched
+        term = terms[0]
+        walks = [
+            _walk_word(entries, search_index, kind, word, len(term) / len(word), [], low, high, categories, after)
+            for word in matches[0]
+        ]
+        if len(walks) > 1:
+            walks = [_best_matches(heapq.merge(*walks, key=lambda item: item[0], reverse=True), term)]
+        return walks
+    if all(len(words) == 1 for words in matches):
+        # One word per term: a single score, walked along the rarest word
+        words = [words[0] for words in matches]
+        lead = min(words, key=lambda word: len(search_index.postings[word][1]))
+        score = sum(len(term) / len(word) for term, word in zip(terms, words))
+        members = [set(search_index.postings[word][1]) for word in words if word != lead]
+        return [_walk_word(entries, search_index, kind, lead, score, members, low, high, categories, after)]
+    if not all(matches):
+        return []
+    return [_walk_ranked(entries, search_index, kind, terms, low, high, categories, after)]
+
+@timed('aggregation')
+def search_entries(terms, kinds, start='', end='', categories=frozenset(), after=None, limit=LIST_DEFAULT_LIMIT):
+    # One page of entries whose descriptions have words starting with every
+    # term, as (key, kind, entry) tuples keyed by (score, date, id): best
+    # match first, then newest, strictly past the cursor key `after`. A
+    # term scores the fraction of the word it matched (1 for the whole
+    # word). Walked under the ledger lock since writers insert into the
+    # same postings.
+    low = date_number(start) if start else 0
+    high = date_number(end, '9') if end else 99999999
+    with _ledger_lock:
+        walks = []
+        for kind in kinds:
+            walks.extend(_search_walks(load_data()[kind], load_search_index(kind), kind, terms, low, high, categories, after))
+        for partition in sealed_partitions(start, end):
+            for kind in kinds:
+                walks.extend(_search_walks(partition.entries[kind], partition.search_index(kind), kind,
+                                           terms, low, high, categories, after))
+        merged = heapq.merge(*walks, key=lambda item: item[0], reverse=True)
+        return list(itertools.islice(merged, limit))
+
+def quarter_range(quarter):
+    # 'YYYY-Qn' -> first and last month of the quarter
+    year, _, number = quarter.upper().partition('-Q')
+    if not (year.isdigit() and len(year) == 4 and number in ('1', '2', '3', '4')):
+        raise ValueError(f'invalid quarter: {quarter}')
+    first = (int(number) - 1) * 3 + 1
+    return f'{year}-{first:02d}', f'{year}-{first + 2:02d}'
+
+def request_date_range():
+    # ?from=&to= (inclusive dates or 'YYYY'/'YYYY-MM' prefixes) or
+    # ?quarter=YYYY-Qn; (None, None) when the request gives neither
+    if request.args.get('quarter'):
+        return quarter_range(request.args['quarter'])
+    if request.args.get('from') or request.args.get('to'):
+        return request.args.get('from', ''), request.args.get('to', '')
+    return None, None
+
+# Period keys for summary series
+YEAR_MONTH = re.compile(r'[0-9]{4}-(0[1-9]|1[0-2])')
+
+def quarter_of(date):
+    # '' for a date without a readable month (older ledgers accepted any
+    # date from the forms)
+    match = YEAR_MONTH.match(date)
+    if match is None:
+        return ''
+    return f'{date[:4]}-Q{(int(match.group(1)) - 1) // 3 + 1}'
+
+SERIES_GROUPS = {
+    'day': lambda date: date[:10],
+    'month': lambda date: date[:7],
+    'quarter': quarter_of,
+    'year': lambda date: date[:4],
+}
+
+@timed('aggregation')
+def summary_series(start, end, group):
+    period_of = SERIES_GROUPS[group]
+    series = defaultdict(lambda: {'income': 0, 'expenses': 0})
+    if group != 'day' and len(start) <= 7 and len(end) <= 7:
+        for month, totals in load_aggregates()['months'].items():
+            if in_date_range(month, start, end):
+                series[period_of(month)]['income'] += totals['income']
+                series[period_of(month)]['expenses'] += totals['expenses']
+    else:
+        for kind in ('income', 'expenses'):
+            for date, cents in iter_fields(kind, ('date', 'cents'), start, end):
+                series[period_of(date)][kind] += cents
+
+    return [
+        {
+            'period': period,
+            'income': from_cents(totals['income']),
+            'expenses': from_cents(totals['expenses']),
+            'balance': from_cents(totals['income'] - totals['expenses'])
+        }
+        for period, totals in sorted(series.items())
+    ]
+
+# Reports for /api/report: entries grouped by any combination of these
+# dimensions, every grouping of a request filled in one pass
+REPORT_DIMENSIONS = ('type', 'year', 'quarter', 'month', 'week', 'category')
+REPORT_SORTS = ('key', 'income', 'expenses', 'balance', 'count')
+
+@functools.lru_cache(maxsize=65536)
+def iso_week(date):
     try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    except:
+        year, week, _ = datetime.strptime(date[:10], '%Y-%m-%d').isocalendar()
+    except ValueError:
+        return ''
+    return f'{year}-W{week:02d}'
+
+def report_key(dimension, kind, date, category):
+    if dimension == 'type':
+        return 'income' if kind == 'income' else 'expense'
+    if dimension == 'category':
+        return category
+    if dimension == 'week':
+        return iso_week(date)
+    return SERIES_GROUPS[dimension](date)
+
+# Day totals: per kind, {(date, category): [cents, count]}. The finer
+# counterpart of the monthly aggregates for reports that need the day; built
+# per worker on first use and then kept in step the same way.
+def _count_day(day_totals, date, category, cents, sign):
+    totals = day_totals.setdefault((date, category), [0, 0])
+    totals[0] += sign * cents
+    totals[1] += sign
+    if totals[1] <= 0:
+        del day_totals[(date, category)]
+
+def build_day_totals(entries):
+    day_totals = {}
+    for date, category, cents in zip(*(column_values(entries, name) for name in ('date', 'category', 'cents'))):
+        if date is not None:
+            _count_day(day_totals, date, category, cents, 1)
+    return day_totals
+
+def load_day_totals(kind):
+    # A copy, so it can be read while a replay updates the original
+    with _ledger_lock:
+        data = load_data()
+        if _ledger_cache['day_totals'] is None:
+            _ledger_cache['day_totals'] = {kind: build_day_totals(data[kind]) for kind in ('income', 'expenses')}
+        return list(_ledger_cache['day_totals'][kind].items())
+
+def report_rows(kinds, start='', end='', daily=False):
+    # (kind, date, category, cents, count) rows for entries dated
+    # start..end: one per month and category from the aggregates when the
+    # bounds are whole months and no grouping needs the day, else one per
+    # day and category
+    if not daily and len(start) <= 7 and len(end) <= 7:
+        for month, month_kinds in load_aggregates()['categories'].items():
+            if in_date_range(month, start, end):
+                for kind in kinds:
+                    for category, stats in month_kinds[kind].items():
+                        yield kind, month, category, stats['amount'], stats['count']
+        return
+    for kind in kinds:
+        sources = [partition.day_totals(kind) for partition in sealed_partitions(start, end)]
+        sources.append(load_day_totals(kind))
+        for day_totals in sources:
+            for (date, category), (cents, count) in day_totals:
+                if in_date_range(date, start, end):
+                    yield kind, date, category, cents, count
+
+@timed('aggregation')
+def build_report(groupings, kinds, start, end, categories, sort, descending, top):
+    # Rows are first summed per (kind, date, category), so each grouping
+    # key is worked out once per distinct day or month rather than per entry
+    daily = any('week' in grouping for grouping in groupings)
+    cells = defaultdict(lambda: [0, 0])
+    for kind, date, category, cents, count in storage.report_rows(kinds, start, end, daily):
+        if categories and category not in categories:
+            continue
+        cell = cells[(kind, date, category)]
+        cell[0] += cents
+        cell[1] += count
+
+    groups = [defaultdict(lambda: {'income': 0, 'expenses': 0, 'count': 0}) for _ in groupings]
+    for (kind, date, category), (cents, count) in cells.items():
+        for grouping, totals in zip(groupings, groups):
+            group = totals[tuple(report_key(dimension, kind, date, category) for dimension in grouping)]
+            group[kind] += cents
+            group['count'] += count
+
+    reports = []
+    for grouping, totals in zip(groupings, groups):
+        if sort == 'key':
+            ordered = sorted(totals.items(), reverse=descending)
+        elif sort == 'balance':
+            ordered = sorted(totals.items(), key=lambda item: item[1]['income'] - item[1]['expenses'], reverse=descending)
+        else:
+            ordered = sorted(totals.items(), key=lambda item: item[1][sort], reverse=descending)
+        reports.append({
+            'group': list(grouping),
+            'total_rows': len(ordered),
+            'rows': [
+                dict(
+                    zip(grouping, key),
+                    income=from_cents(group['income']),
+                    expenses=from_cents(group['expenses']),
+                    balance=from_cents(group['income'] - group['expenses']),
+                    count=group['count']
+                )
+                for key, group in ordered[:top]
+            ]
+        })
+    return reports
+
+# Sealed partitions. With LEDGER_PARTITIONS on, compaction moves every
+# entry dated before the open period into the partition for its year or
+# month. A partition is a snapshot file of its own that is written when it
+# is sealed and then only replaced if a backdated entry is sealed into it or
+# one of its entries is deleted. The manifest lists the partitions with
+# their aggregates, so totals and whole-month reports never open them.
+_partitions = {'signature': None, 'manifest': None, 'aggregates': None, 'loaded': {}, 'merged_key': None, 'merged': None}
+
+class Partition:
+    # One sealed partition, loaded on first use; its date, listing, search
+    # and ID indexes and day totals are built (or, for a binary file, mapped)
+    # per worker as needed
+    def __init__(self, period, path):
+        self.period = period
+        self.path = path
+        with open(path, 'rb') as f:
+            if path.endswith('.snap'):
+                self.entries = Snapshot(f).entries()
+            else:
+                stored = json.load(f, object_hook=ledger_entry)
+                self.entries = {kind: stored[kind] for kind in ('income', 'expenses')}
+        self.date_indexes = {}
+        self.listing_indexes = {}
+        self.ids = None
+        self.days = {}
+        self.search_indexes = {}
+
+    def range_positions(self, kind, start, end):
+        if kind not in self.date_indexes:
+            self.date_indexes[kind] = build_date_index(self.entries[kind])
+        return range_positions(self.entries[kind], self.date_indexes[kind], start, end)
+
+    def listing_index(self, kind, sort, category):
+        if (kind, sort, category) not in self.listing_indexes:
+            self.listing_indexes[(kind, sort, category)] = build_listing_index(self.entries[kind], sort, category)
+        return self.listing_indexes[(kind, sort, category)]
+
+    def search_index(self, kind):
+        if kind not in self.search_indexes:
+            self.search_indexes[kind] = SearchIndex(self.entries[kind])
+        return self.search_indexes[kind]
+
+    def day_totals(self, kind):
+        if kind not in self.days:
+            self.days[kind] = list(build_day_totals(self.entries[kind]).items())
+        return self.days[kind]
+
+    def find(self, entry_id):
+        if self.ids is None:
+            self.ids = build_id_index(self.entries)
+        return self.ids.get(entry_id)
+
+def open_period():
+    # Entries dated before this period are sealed at the next compaction
+    return datetime.now().strftime('%Y-%m-%d')[:PARTITION_LENGTH]
+
+def load_manifest():
+    # Re-read when the manifest changes on disk; partitions loaded from a
+    # file the manifest no longer names are dropped
+    with _ledger_lock:
+        signature = file_signature(PARTITIONS_MANIFEST)
+        if signature != _partitions['signature'] or _partitions['manifest'] is None:
+            try:
+                with open(PARTITIONS_MANIFEST, 'r') as f:
+                    manifest = json.load(f)
+            except FileNotFoundError:
+                manifest = {'generation': 0, 'sealed_generation': 0, 'cents': True, 'partitions': {}}
+            if not manifest.get('cents'):
+                for stored in manifest['partitions'].values():
+                    aggregates_in_cents(stored['aggregates'])
+                manifest['cents'] = True
+            _partitions['signature'] = signature
+            _partitions['manifest'] = manifest
+            _partitions['aggregates'] = merge_aggregates(
+                [stored['aggregates'] for stored in manifest['partitions'].values()]
+            )
+            _partitions['loaded'] = {
+                period: partition for period, partition in _partitions['loaded'].items()
+                if period in manifest['partitions']
+                and partition.path == os.path.join(PARTITIONS_DIR, manifest['partitions'][period]['file'])
+            }
+        return _partitions['manifest']
+
+def _period_overlaps(period, start, end):
+    return (not start or period + DATE_PREFIX_END >= start) and (not end or period <= end + DATE_PREFIX_END)
+
+def sealed_partitions(start='', end=''):
+    # Partitions that may hold entries dated start..end, oldest first
+    with _ledger_lock:
+        for attempt in range(2):
+            periods = [
+                period for period in sorted(load_manifest()['partitions'])
+                if _period_overlaps(period, start, end)
+            ]
+            try:
+                return [_load_partition(period) for period in periods]
+            except FileNotFoundError:
+                # Replaced by a writer since the manifest was read
+                _partitions['signature'] = None
+        return [_load_partition(period) for period in periods]
+
+def newest_partitions():
+    # Sealed partitions newest first, each loaded only when reached
+    for period in sorted(load_manifest()['partitions'], reverse=True):
+        with _ledger_lock:
+            if period in load_manifest()['partitions']:
+                yield _load_partition(period)
+
+def _load_partition(period):
+    partition = _partitions['loaded'].get(period)
+    if partition is None:
+        path = os.path.join(PARTITIONS_DIR, _partitions['manifest']['partitions'][period]['file'])
+        partition = _partitions['loaded'][period] = Partition(period, path)
+    return partition
+
+def merge_aggregates(parts):
+    merged = _new_aggregates()
+    for aggregates in parts:
+        for kind in ('income', 'expenses'):
+            merged['totals'][kind] += aggregates['totals'][kind]
+        for month, totals in aggregates['months'].items():
+            month_totals = merged['months'].setdefault(month, {'income': 0, 'expenses': 0, 'count': 0})
+            for kind in ('income', 'expenses'):
+                month_totals[kind] += totals[kind]
+            month_totals['count'] += totals['count']
+        for month, kinds in aggregates['categories'].items():
+            month_categories = merged['categories'].setdefault(month, {'income': {}, 'expenses': {}})
+            for kind, categories in kinds.items():
+                for category, stats in categories.items():
+                    merged_stats = month_categories[kind].setdefault(category, {'amount': 0, 'count': 0})
+                    merged_stats['amount'] += stats['amount']
+                    merged_stats['count'] += stats['count']
+    return merged
+
+def _partition_file(period, generation):
+    return f"{period}.g{generation}.{'snap' if SNAPSHOT_FORMAT == 'binary' else 'json'}"
+
+def write_partitions(partitions, sealed_generation=None):
+    # Writes new files for the given partitions ({period: {kind: entries}})
+    # and then the manifest naming them; the files they replace are removed
+    # last, so readers of the previous manifest can still open them
+    manifest = json.loads(json.dumps(load_manifest()))
+    manifest['generation'] += 1
+    replaced = []
+    os.makedirs(PARTITIONS_DIR, exist_ok=True)
+    for period, data in partitions.items():
+        name = _partition_file(period, manifest['generation'])
+        path = os.path.join(PARTITIONS_DIR, name)
+        if SNAPSHOT_FORMAT == 'binary':
+            write_file_atomic(path, lambda f: write_snapshot(f, data, manifest['generation']), 'wb')
+        else:
+            write_file_atomic(path, lambda f: json.dump(dict(data, period=period), f, indent=2, default=dict))
+        if period in manifest['partitions']:
+            replaced.append(manifest['partitions'][period]['file'])
+        manifest['partitions'][period] = {'file': name, 'aggregates': build_aggregates(data)}
+    if sealed_generation is not None:
+        manifest['sealed_generation'] = sealed_generation
+    write_file_atomic(PARTITIONS_MANIFEST, lambda f: json.dump(manifest, f))
+    for name in replaced:
+        os.remove(os.path.join(PARTITIONS_DIR, name))
+    load_manifest()
+
+def _partition_contents(period):
+    # A sealed partition's entries as plain lists, to be written anew
+    if period not in load_manifest()['partitions']:
         return {'income': [], 'expenses': []}
+    partition = _load_partition(period)
+    return {kind: [entry for entry in partition.entries[kind] if entry is not None] for kind in ('income', 'expenses')}
+
+def seal_partitions(live, generation):
+    # Moves entries dated before the open period from the live ledger into
+    # their partitions and returns what stays live. An entry already in its
+    # partition (from a seal that did not get to rewrite the live snapshot)
+    # is dropped rather than sealed twice.
+    opening = open_period()
+    periods = sorted(load_manifest()['partitions'], key=len, reverse=True)
+    period_of = {}
+    due = {}
+    rest = {'income': [], 'expenses': []}
+    for kind in ('income', 'expenses'):
+        for entry in live[kind]:
+            if entry['date'][:PARTITION_LENGTH] >= opening:
+                rest[kind].append(entry)
+                continue
+            month = entry['date'][:7]
+            if month not in period_of:
+                # An existing partition covering the date (LEDGER_PARTITIONS
+                # may have changed since it was sealed), else a new one
+                period_of[month] = next((period for period in periods if month.startswith(period)),
+                                        month[:PARTITION_LENGTH])
+            due.setdefault(period_of[month], {'income': [], 'expenses': []})[kind].append(entry)
+    if not due:
+        return live
+
+    partitions = {}
+    for period, entries in due.items():
+        data = partitions[period] = _partition_contents(period)
+        sealed = set(column_values(data['income'] + data['expenses'], 'id'))
+        for kind in ('income', 'expenses'):
+            data[kind].extend(entry for entry in entries[kind] if entry.get('id') not in sealed)
+    write_partitions(partitions, sealed_generation=generation)
+    return rest
+
+def delete_sealed(ids, kind=None):
+    # Deletes entries from sealed partitions, rewriting each partition that
+    # held one; returns the IDs deleted
+    with ledger_write_lock():
+        remaining = set(ids)
+        partitions = {}
+        for partition in newest_partitions():
+            if not remaining:
+                break
+            found = set()
+            for entry_id in remaining:
+                location = partition.find(entry_id)
+                if location is not None and (kind is None or location[0] == kind):
+                    found.add(entry_id)
+            if found:
+                data = _partition_contents(partition.period)
+                partitions[partition.period] = {
+                    entry_kind: [entry for entry in entries if entry.get('id') not in found]
+                    for entry_kind, entries in data.items()
+                }
+                remaining -= found
+        if partitions:
+            write_partitions(partitions)
+            write_stats['delete'] += len(ids) - len(remaining)
+        return [entry_id for entry_id in ids if entry_id not in remaining]
+
+# Storage backends. Routes go through `storage`, which is either the JSON
+# files above (fine for small setups) or an indexed SQLite database.
+class JsonStorage:
+    def __init__(self):
+        self.paths = (DATA_FILE, JOURNAL_FILE, PARTITIONS_MANIFEST)
+
+    def init(self):
+        init_data()
+
+    def version(self):
+        # Changes whenever the snapshot or journal changes on disk, and is
+        # cheap enough to check without loading the ledger
+        parts = []
+        for path in self.paths:
+            signature = file_signature(path)
+            parts.append('%x.%x.%x' % signature if signature else '0')
+        return '-'.join(parts)
+
+    def load(self):
+        return {kind: list(iter_entries(kind)) for kind in ('income', 'expenses')}
+
+    def write(self, records):
+        write_records(records)
+
+    def add_entry(self, kind, entry):
+        add_entry(kind, entry)
+
+    def delete_entry(self, kind, index):
+        return delete_entry(kind, index)
+
+    def delete_ids(self, ids, kind=None):
+        return delete_ids(ids, kind)
+
+    def totals(self):
+        totals = load_aggregates()['totals']
+        return from_cents(totals['income']), from_cents(totals['expenses'])
+
+    def monthly_summary(self, limit):
+        months = load_aggregates()['months']
+        return {
+            month: {'income': from_cents(months[month]['income']), 'expenses': from_cents(months[month]['expenses'])}
+            for month in sorted(months, reverse=True)[:limit]
+        }
+
+    def category_totals(self, kind, month):
+        categories = load_aggregates()['categories'].get(month, {}).get(kind, {})
+        return {category: from_cents(stats['amount']) for category, stats in categories.items()}
+
+    def recent(self, kind, limit):
+        # Newest first, skipping tombstones; sealed partitions are only
+        # opened when the live ledger has too few entries
+        recent = []
+        ledgers = itertools.chain([load_data()[kind]], (partition.entries[kind] for partition in newest_partitions()))
+        for entries in ledgers:
+            for item in reversed(entries):
+                if len(recent) == limit:
+                    return recent
+                if item is not None:
+                    recent.append(item)
+        return recent
+
+    def iter_entries(self, kind, start='', end=''):
+        return iter_entries(kind, start, end)
+
+    def list_entries(self, kinds, sort, descending, start, end, category, after, limit):
+        return list_entries(kinds, sort, descending, start, end, category, after, limit)
+
+    def search(self, terms, kinds, start, end, categories, after, limit):
+        return search_entries(terms, kinds, start, end, categories, after, limit)
+
+    def entry_counts(self):
+        counts = {'income': 0, 'expenses': 0}
+        for month in load_aggregates()['categories'].values():
+            for kind in counts:
+                counts[kind] += sum(stats['count'] for stats in month[kind].values())
+        return counts
+
+    def range_totals(self, start='', end=''):
+        return range_totals(start, end)
+
+    def series(self, start, end, group):
+        return summary_series(start, end, group)
+
+    def report_rows(self, kinds, start, end, daily):
+        return report_rows(kinds, start, end, daily)
+
+    def compact(self):
+        compact_data()
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    entry_id TEXT,
+    kind TEXT NOT NULL,
+    date TEXT NOT NULL,
+    description TEXT NOT NULL,
+    amount REAL NOT NULL,
+    category TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_entry_id ON transactions (entry_id);
+CREATE INDEX IF NOT EXISTS transactions_kind ON transactions (kind);
+-- Listing indexes end in entry_id so keyset pages on (date or amount,
+-- entry_id) are a single index range scan
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date, entry_id);
+CREATE INDEX IF NOT EXISTS transactions_amount ON transactions (amount, entry_id);
+CREATE INDEX IF NOT EXISTS transactions_kind_date_entry_id ON transactions (kind, date, entry_id);
+CREATE INDEX IF NOT EXISTS transactions_kind_amount ON transactions (kind, amount, entry_id);
+CREATE INDEX IF NOT EXISTS transactions_category_date_entry_id ON transactions (category, date, entry_id);
+DROP INDEX IF EXISTS transactions_kind_date;
+DROP INDEX IF EXISTS transactions_category_date;
+
+-- Per-month-per-category totals in integer cents, kept up to date by
+-- triggers, so the dashboard's totals and month reports never scan the
+-- transactions table and never accumulate float error
+CREATE TABLE IF NOT EXISTS monthly_totals (
+    month TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    category TEXT NOT NULL,
+    cents INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (month, kind, category)
+);
+CREATE TRIGGER IF NOT EXISTS transactions_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO monthly_totals (month, kind, category, cents, count)
+    VALUES (substr(NEW.date, 1, 7), NEW.kind, NEW.category, CAST(ROUND(NEW.amount * 100) AS INTEGER), 1)
+    ON CONFLICT (month, kind, category) DO UPDATE
+    SET cents = cents + excluded.cents, count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS transactions_delete AFTER DELETE ON transactions BEGIN
+    UPDATE monthly_totals SET cents = cents - CAST(ROUND(OLD.amount * 100) AS INTEGER), count = count - 1
+    WHERE month = substr(OLD.date, 1, 7) AND kind = OLD.kind AND category = OLD.category;
+    DELETE FROM monthly_totals
+    WHERE month = substr(OLD.date, 1, 7) AND kind = OLD.kind AND category = OLD.category AND count <= 0;
+END;
+
+-- Full-text index over descriptions for /api/search, reading the text from
+-- transactions and kept in step by triggers; words are split like
+-- search_terms does
+CREATE VIRTUAL TABLE IF NOT EXISTS transactions_search USING fts5(
+    description, content = 'transactions', content_rowid = 'id',
+    tokenize = "unicode61 remove_diacritics 0 tokenchars '_'"
+);
+CREATE TRIGGER IF NOT EXISTS transactions_search_insert AFTER INSERT ON transactions BEGIN
+    INSERT INTO transactions_search (rowid, description) VALUES (NEW.id, NEW.description);
+END;
+CREATE TRIGGER IF NOT EXISTS transactions_search_delete AFTER DELETE ON transactions BEGIN
+    INSERT INTO transactions_search (transactions_search, rowid, description)
+    VALUES ('delete', OLD.id, OLD.description);
+END;
+
+-- 'version' is bumped by every write and backs ETags and fragment caching
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+'''
+
+# Databases whose monthly_totals predate cents get them rebuilt from the
+# transactions, in one transaction with the schema
+SQLITE_REBUILD_TOTALS = f'''
+BEGIN IMMEDIATE;
+DROP TRIGGER IF EXISTS transactions_insert;
+DROP TRIGGER IF EXISTS transactions_delete;
+DROP TABLE IF EXISTS monthly_totals;
+{SQLITE_SCHEMA}
+INSERT INTO monthly_totals (month, kind, category, cents, count)
+SELECT substr(date, 1, 7), kind, category, SUM(CAST(ROUND(amount * 100) AS INTEGER)), COUNT(*)
+FROM transactions GROUP BY substr(date, 1, 7), kind, category;
+COMMIT;
+'''
+
+# An amount column in integer cents, for exact sums
+SQL_CENTS = 'CAST(ROUND(amount * 100) AS INTEGER)'
+
+# SQL expressions for each summary series grouping
+SQL_SERIES_GROUPS = {
+    'day': 'substr(date, 1, 10)',
+    'month': 'substr(date, 1, 7)',
+    'quarter': "CASE WHEN date GLOB '[0-9][0-9][0-9][0-9]-[01][0-9]*' AND substr(date, 6, 2) BETWEEN '01' AND '12' "
+               "THEN substr(date, 1, 4) || '-Q' || ((CAST(substr(date, 6, 2) AS INTEGER) + 2) / 3) ELSE '' END",
+    'year': 'substr(date, 1, 4)',
+}
+
+class SqliteStorage:
+    ENTRY_COLUMNS = 'entry_id, date, description, amount, category, timestamp'
+    SELECT_COLUMNS = 'entry_id AS id, date, description, amount, category, timestamp'
+
+    def __init__(self, path):
+        self.path = path
+        self.paths = (path, path + '-wal')
+        self._local = threading.local()
+
+    def connection(self):
+        # One connection per thread, reopened in forked workers
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            columns = [row['name'] for row in conn.execute('PRAGMA table_info(transactions)')]
+            if columns and 'entry_id' not in columns:
+                # Databases created before entry IDs
+                with conn:
+                    conn.execute('ALTER TABLE transactions ADD COLUMN entry_id TEXT')
+                    conn.execute('UPDATE transactions SET entry_id = lower(hex(randomblob(8)))')
+            indexed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transactions_search'").fetchone()
+            totals_columns = [row['name'] for row in conn.execute('PRAGMA table_info(monthly_totals)')]
+            if totals_columns and 'cents' not in totals_columns:
+                conn.executescript(SQLITE_REBUILD_TOTALS)
+            conn.executescript(SQLITE_SCHEMA)
+            if columns and not indexed:
+                # Databases created before search get their descriptions indexed
+                with conn:
+                    conn.execute("INSERT INTO transactions_search (transactions_search) VALUES ('rebuild')")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def init(self):
+        self.connection()
+
+    def version(self):
+        row = self.connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return f'sqlite-{row[0]}'
+
+    def load(self):
+        return {kind: list(self.iter_entries(kind)) for kind in ('income', 'expenses')}
+
+    @timed('save')
+    def write(self, records):
+        # One transaction per batch; consecutive adds go through executemany
+        for record in records:
+            if record['op'] == 'add':
+                record['entry'].setdefault('id', new_entry_id())
+        conn = self.connection()
+        deleted = 0
+        with conn:
+            pending = []
+            for record in records + [None]:
+                if record is not None and record['op'] == 'add':
+                    entry = record['entry']
+                    pending.append((record['kind'], entry['id'], entry['date'], entry['description'],
+                                    float(entry['amount']), entry['category'], entry.get('timestamp', '')))
+                    continue
+                if pending:
+                    conn.executemany(
+                        f'INSERT INTO transactions (kind, {self.ENTRY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        pending
+                    )
+                    pending = []
+                if record is not None and record['op'] == 'delete' and 'id' in record:
+                    deleted += conn.execute('DELETE FROM transactions WHERE entry_id = ?', (record['id'],)).rowcount
+                elif record is not None and record['op'] == 'delete':
+                    deleted += conn.execute(
+                        'DELETE FROM transactions WHERE id = '
+                        '(SELECT id FROM transactions WHERE kind = ? ORDER BY id LIMIT 1 OFFSET ?)',
+                        (record['kind'], record['index'])
+                    ).rowcount
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        write_stats['add'] += sum(1 for record in records if record['op'] == 'add')
+        write_stats['delete'] += deleted
+        return deleted
+
+    def add_entry(self, kind, entry):
+        self.write([{'op': 'add', 'kind': kind, 'entry': entry}])
+
+    def delete_entry(self, kind, index):
+        if index < 0:
+            return False
+        return self.write([{'op': 'delete', 'kind': kind, 'index': index}]) > 0
+
+    @timed('save')
+    def delete_ids(self, ids, kind=None):
+        conn = self.connection()
+        deleted = []
+        with conn:
+            for entry_id in dict.fromkeys(ids):
+                if kind is None:
+                    cursor = conn.execute('DELETE FROM transactions WHERE entry_id = ?', (entry_id,))
+                else:
+                    cursor = conn.execute('DELETE FROM transactions WHERE entry_id = ? AND kind = ?', (entry_id, kind))
+                if cursor.rowcount:
+                    deleted.append(entry_id)
+            if deleted:
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        write_stats['delete'] += len(deleted)
+        return deleted
+
+    def totals(self):
+        totals = {'income': 0.0, 'expenses': 0.0}
+        for row in self.connection().execute('SELECT kind, SUM(cents) AS cents FROM monthly_totals GROUP BY kind'):
+            totals[row['kind']] = from_cents(row['cents'])
+        return totals['income'], totals['expenses']
+
+    def monthly_summary(self, limit):
+        summary = {}
+        rows = self.connection().execute(
+            'SELECT month, kind, SUM(cents) AS cents FROM monthly_totals '
+            'WHERE month IN (SELECT DISTINCT month FROM monthly_totals ORDER BY month DESC LIMIT ?) '
+            'GROUP BY month, kind ORDER BY month DESC',
+            (limit,)
+        )
+        for row in rows:
+            summary.setdefault(row['month'], {'income': 0.0, 'expenses': 0.0})[row['kind']] = from_cents(row['cents'])
+        return summary
+
+    def category_totals(self, kind, month):
+        rows = self.connection().execute(
+            'SELECT category, cents FROM monthly_totals WHERE month = ? AND kind = ?',
+            (month, kind)
+        )
+        return {row['category']: from_cents(row['cents']) for row in rows}
+
+    def recent(self, kind, limit):
+        rows = self.connection().execute(
+            f'SELECT {self.SELECT_COLUMNS} FROM transactions WHERE kind = ? ORDER BY transactions.id DESC LIMIT ?',
+            (kind, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def iter_entries(self, kind, start='', end=''):
+        # Ledger order when unfiltered, date order for a date range
+        if not start and not end:
+            rows = self.connection().execute(
+                f'SELECT {self.SELECT_COLUMNS} FROM transactions WHERE kind = ? ORDER BY transactions.id', (kind,))
+        else:
+            rows = self.connection().execute(
+                f'SELECT {self.SELECT_COLUMNS} FROM transactions '
+                'WHERE kind = ? AND date >= ? AND date <= ? ORDER BY date, transactions.id',
+                (kind, start, end + DATE_PREFIX_END)
+            )
+        for row in rows:
+            yield dict(row)
+
+    @timed('aggregation')
+    def list_entries(self, kinds, sort, descending, start, end, category, after, limit):
+        # Keyset pagination on (sort column, entry_id), same order as JsonStorage
+        clauses, params = [], []
+        if len(kinds) == 1:
+            clauses.append('kind = ?')
+            params.append(kinds[0])
+        if start:
+            clauses.append('date >= ?')
+            params.append(start)
+        if end:
+            clauses.append('date <= ?')
+            params.append(end + DATE_PREFIX_END)
+        if category is not None:
+            clauses.append('category = ?')
+            params.append(category)
+        if after is not None:
+            clauses.append(f"({sort}, entry_id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+        direction = 'DESC' if descending else 'ASC'
+        rows = self.connection().execute(
+            f'SELECT kind, {self.SELECT_COLUMNS} FROM transactions {where} '
+            f'ORDER BY {sort} {direction}, entry_id {direction} LIMIT ?',
+            params + [limit]
+        )
+        page = []
+        for row in rows:
+            entry = dict(row)
+            kind = entry.pop('kind')
+            page.append(((entry[sort], entry['id']), kind, entry))
+        return page
+
+    def search(self, terms, kinds, start, end, categories, after, limit):
+        # Prefix terms against the full-text index, ranked by bm25 (negated,
+        # so higher is better) and then newest first; keyset pagination on
+        # (score, date, entry_id)
+        clauses = ['transactions_search MATCH ?']
+        params = [' '.join(f'"{term}"*' for term in terms)]
+        if len(kinds) == 1:
+            clauses.append('kind = ?')
+            params.append(kinds[0])
+        if start:
+            clauses.append('date >= ?')
+            params.append(start)
+        if end:
+            clauses.append('date <= ?')
+            params.append(end + DATE_PREFIX_END)
+        if categories:
+            clauses.append(f"category IN ({', '.join('?' * len(categories))})")
+            params.extend(sorted(categories))
+        keyset = ''
+        if after is not None:
+            keyset = 'WHERE (score, date, id) < (?, ?, ?)'
+            params.extend(after)
+        rows = self.connection().execute(
+            'SELECT * FROM ('
+            'SELECT kind, entry_id AS id, date, transactions.description AS description, amount, category, timestamp, '
+            '-bm25(transactions_search) AS score '
+            'FROM transactions_search JOIN transactions ON transactions.id = transactions_search.rowid '
+            f"WHERE {' AND '.join(clauses)}) {keyset} "
+            'ORDER BY score DESC, date DESC, id DESC LIMIT ?',
+            params + [limit]
+        )
+        page = []
+        for row in rows:
+            entry = dict(row)
+            kind = entry.pop('kind')
+            score = entry.pop('score')
+            page.append(((score, entry['date'], entry['id']), kind, entry))
+        return page
+
+    def entry_counts(self):
+        counts = {'income': 0, 'expenses': 0}
+        rows = self.connection().execute('SELECT kind, SUM(count) FROM monthly_totals GROUP BY kind')
+        for kind, count in rows:
+            counts[kind] = count
+        return counts
+
+    @timed('aggregation')
+    def range_totals(self, start='', end=''):
+        totals = {'income': 0, 'expenses': 0}
+        if len(start) <= 7 and len(end) <= 7:
+            rows = self.connection().execute(
+                'SELECT kind, SUM(cents) AS cents FROM monthly_totals '
+                'WHERE month >= ? AND month <= ? GROUP BY kind',
+                (start, end + DATE_PREFIX_END)
+            )
+        else:
+            rows = self.connection().execute(
+                f'SELECT kind, SUM({SQL_CENTS}) AS cents FROM transactions '
+                'WHERE kind IN (?, ?) AND date >= ? AND date <= ? GROUP BY kind',
+                ('income', 'expenses', start, end + DATE_PREFIX_END)
+            )
+        for row in rows:
+            totals[row['kind']] = row['cents']
+        return from_cents(totals['income']), from_cents(totals['expenses'])
+
+    @timed('aggregation')
+    def series(self, start, end, group):
+        period = SQL_SERIES_GROUPS[group]
+        if group != 'day' and len(start) <= 7 and len(end) <= 7:
+            # monthly_totals' month column is a 'YYYY-MM' date prefix
+            period = period.replace('date', 'month')
+            cents = 'cents'
+            source = 'monthly_totals WHERE month >= ? AND month <= ?'
+        else:
+            cents = SQL_CENTS
+            source = "transactions WHERE kind IN ('income', 'expenses') AND date >= ? AND date <= ?"
+        series = {}
+        rows = self.connection().execute(
+            f'SELECT {period} AS period, kind, SUM({cents}) AS cents FROM {source} GROUP BY period, kind',
+            (start, end + DATE_PREFIX_END)
+        )
+        for row in rows:
+            series.setdefault(row['period'], {'income': 0, 'expenses': 0})[row['kind']] = row['cents']
+        return [
+            {
+                'period': period,
+                'income': from_cents(totals['income']),
+                'expenses': from_cents(totals['expenses']),
+                'balance': from_cents(totals['income'] - totals['expenses'])
+            }
+            for period, totals in sorted(series.items())
+        ]
+
+    def report_rows(self, kinds, start, end, daily):
+        # Pre-summed per day (or month) and category, like the JSON rows
+        kind_placeholders = ', '.join('?' * len(kinds))
+        if not daily and len(start) <= 7 and len(end) <= 7:
+            rows = self.connection().execute(
+                'SELECT kind, month, category, cents, count FROM monthly_totals '
+                f'WHERE kind IN ({kind_placeholders}) AND month >= ? AND month <= ? AND count > 0',
+                (*kinds, start, end + DATE_PREFIX_END)
+            )
+        else:
+            rows = self.connection().execute(
+                f'SELECT kind, date, category, SUM({SQL_CENTS}), COUNT(*) FROM transactions '
+                f'WHERE kind IN ({kind_placeholders}) AND date >= ? AND date <= ? GROUP BY kind, date, category',
+                (*kinds, start, end + DATE_PREFIX_END)
+            )
+        return [tuple(row) for row in rows]
+
+    def compact(self):
+        self.connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+if STORAGE_BACKEND == 'sqlite':
+    storage = SqliteStorage(SQLITE_FILE)
+elif STORAGE_BACKEND == 'json':
+    storage = JsonStorage()
+else:
+    raise ValueError(f'unknown STORAGE_BACKEND: {STORAGE_BACKEND}')
+
+@app.cli.command('compact')
+def compact_command():
+    """Fold the journal into the JSON snapshot and seal closed periods (checkpoint the WAL for SQLite)."""
+    storage.compact()
+
+@app.cli.command('migrate-sqlite')
+@click.option('--db', default=SQLITE_FILE, show_default=True, help='SQLite database to create or fill.')
+def migrate_sqlite_command(db):
+    """Copy the file ledger (snapshot plus journal) into a SQLite database."""
+    target = SqliteStorage(db)
+    if target.connection().execute('SELECT 1 FROM transactions LIMIT 1').fetchone():
+        raise click.ClickException(f'{db} already holds transactions')
+    records = [
+        {'op': 'add', 'kind': kind, 'entry': entry}
+        for kind in ('income', 'expenses')
+        for entry in iter_entries(kind)
+    ]
+    target.write(records)
+    counts = {kind: sum(1 for record in records if record['kind'] == kind) for kind in ('income', 'expenses')}
+    click.echo(f"Migrated {counts['income']} income and {counts['expenses']} expense entries to {db}")
+
+@app.cli.command('export-json')
+@click.option('--out', default='financial_data.export.json', show_default=True, help='File to write.')
+def export_json_command(out):
+    """Write the ledger as JSON, whatever the storage backend or snapshot format."""
+    data = storage.load()
+    if os.path.abspath(out) == os.path.abspath(DATA_FILE):
+        raise click.ClickException(f'{out} is the live snapshot; choose another file')
+    write_file_atomic(out, lambda f: json.dump(data, f, indent=2, default=dict))
+    click.echo(f"Wrote {len(data['income'])} income and {len(data['expenses'])} expense entries to {out}")
 
 # HTML Template
 HTML_TEMPLATE = '''
@@ -187,21 +2756,7 @@ HTML_TEMPLATE = '''
     <div class="container">
         <h1>💰 Financial Reports System</h1>
         
-        <!-- Statistics Dashboard -->
-        <div class="dashboard">
-            <div class="card stat-card">
-                <div class="stat-label">Total Income</div>
-                <div class="stat-value income">€{{ "%.2f"|format(total_income) }}</div>
-            </div>
-            <div class="card stat-card">
-                <div class="stat-label">Total Expenses</div>
-                <div class="stat-value expense">€{{ "%.2f"|format(total_expenses) }}</div>
-            </div>
-            <div class="card stat-card">
-                <div class="stat-label">Net Balance</div>
-                <div class="stat-value balance">€{{ "%.2f"|format(balance) }}</div>
-            </div>
-        </div>
+        <div id="fragment-stats" style="display: contents;">{{ fragments.stats }}</div>
 
         <!-- Add Transaction Forms -->
         <div class="dashboard">
@@ -288,7 +2843,116 @@ HTML_TEMPLATE = '''
                 <button onclick="exportReport()">Export CSV</button>
             </div>
 
-            <!-- Monthly Summary -->
+            <div id="fragment-summary" style="display: contents;">{{ fragments.summary }}</div>
+        </div>
+
+        <div id="fragment-recent" style="display: contents;">{{ fragments.recent }}</div>
+    </div>
+
+    <script>
+        function filterTransactions() {
+            const month = document.getElementById('monthFilter').value;
+            const category = document.getElementById('categoryFilter').value;
+            // This would typically make an AJAX call to filter data
+            window.location.href = `/?month=${month}&category=${category}`;
+        }
+
+        function exportReport() {
+            const month = document.getElementById('monthFilter').value;
+            window.location.href = `/export?month=${month}`;
+        }
+
+        // Live updates: /api/stream sends the dashboard fragments that changed
+        // after any write, from this page or elsewhere, and they are swapped in
+        // place. Without it the page reloads after a write, as the plain forms do.
+        const stream = window.EventSource ? new EventSource('/api/stream') : null;
+        if (stream) {
+            stream.addEventListener('ledger', (event) => {
+                for (const [name, html] of Object.entries(JSON.parse(event.data))) {
+                    document.getElementById(`fragment-${name}`).innerHTML = html;
+                }
+            });
+        }
+
+        function patchTotals(totals) {
+            for (const name of ['income', 'expenses', 'balance']) {
+                document.getElementById(`total-${name}`).textContent = `€${totals[name].toFixed(2)}`;
+            }
+        }
+
+        // Add and delete forms go to the JSON endpoints instead of posting
+        // and redirecting; the totals are patched from the response
+        document.addEventListener('submit', async (event) => {
+            const form = event.target;
+            const action = form.getAttribute('action');
+            let body;
+            let url = '/api/transactions';
+            if (action === '/add_income' || action === '/add_expense') {
+                body = Object.fromEntries(new FormData(form));
+                body.type = action === '/add_income' ? 'income' : 'expense';
+            } else if ((action === '/delete_income' || action === '/delete_expense') && form.elements.id) {
+                url = '/api/transactions/delete';
+                body = {ids: [form.elements.id.value]};
+            } else {
+                return;
+            }
+            event.preventDefault();
+            let response;
+            try {
+                response = await fetch(url, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify(body)
+                });
+            } catch (error) {
+                form.submit();
+                return;
+            }
+            if (!(response.headers.get('Content-Type') || '').startsWith('application/json')) {
+                // Not an answer from the JSON endpoints, say a proxy's error page
+                alert(`Request failed (${response.status})`);
+                return;
+            }
+            const result = await response.json();
+            if (!response.ok) {
+                alert(result.error);
+                return;
+            }
+            patchTotals(result.aggregates.totals);
+            if (body.ids) {
+                form.closest('tr').remove();
+            } else {
+                form.reset();
+            }
+            if (!stream || stream.readyState !== EventSource.OPEN) {
+                window.location.reload();
+            }
+        });
+    </script>
+</body>
+</html>
+'''
+
+# Stat cards
+STATS_TEMPLATE = '''<!-- Statistics Dashboard -->
+        <div class="dashboard">
+            <div class="card stat-card">
+                <div class="stat-label">Total Income</div>
+                <div class="stat-value income" id="total-income">€{{ "%.2f"|format(total_income) }}</div>
+            </div>
+            <div class="card stat-card">
+                <div class="stat-label">Total Expenses</div>
+                <div class="stat-value expense" id="total-expenses">€{{ "%.2f"|format(total_expenses) }}</div>
+            </div>
+            <div class="card stat-card">
+                <div class="stat-label">Net Balance</div>
+                <div class="stat-value balance" id="total-balance">€{{ "%.2f"|format(balance) }}</div>
+            </div>
+        </div>
+'''
+
+# Monthly summary and current-month category breakdown
+SUMMARY_TEMPLATE = '''<!-- Monthly Summary -->
             <div style="margin: 20px 0;">
                 <h3 style="color: #333; margin-bottom: 10px;">Monthly Summary</h3>
                 <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 15px;">
@@ -315,9 +2979,10 @@ HTML_TEMPLATE = '''
                     {% endfor %}
                 </div>
             </div>
-        </div>
+'''
 
-        <!-- Recent Transactions -->
+# Recent income and expense tables
+RECENT_TEMPLATE = '''<!-- Recent Transactions -->
         <div class="dashboard">
             <!-- Recent Income -->
             <div class="card">
@@ -342,7 +3007,7 @@ HTML_TEMPLATE = '''
                                 <td style="color: #22c55e; font-weight: 600;">€{{ "%.2f"|format(item.amount) }}</td>
                                 <td>
                                     <form method="POST" action="/delete_income" style="display: inline;">
-                                        <input type="hidden" name="index" value="{{ item.index }}">
+                                        <input type="hidden" name="id" value="{{ item.id }}">
                                         <button type="submit" class="delete-btn">Delete</button>
                                     </form>
                                 </td>
@@ -376,7 +3041,7 @@ HTML_TEMPLATE = '''
                                 <td style="color: #ef4444; font-weight: 600;">€{{ "%.2f"|format(item.amount) }}</td>
                                 <td>
                                     <form method="POST" action="/delete_expense" style="display: inline;">
-                                        <input type="hidden" name="index" value="{{ item.index }}">
+                                        <input type="hidden" name="id" value="{{ item.id }}">
                                         <button type="submit" class="delete-btn">Delete</button>
                                     </form>
                                 </td>
@@ -387,174 +3052,780 @@ HTML_TEMPLATE = '''
                 </div>
             </div>
         </div>
-    </div>
+'''
 
-    <script>
-        function filterTransactions() {
-            const month = document.getElementById('monthFilter').value;
-            const category = document.getElementById('categoryFilter').value;
-            // This would typically make an AJAX call to filter data
-            window.location.href = `/?month=${month}&category=${category}`;
-        }
+# Dashboard templates are compiled once per process. The static shell
+# (styles, forms, script) is cached per day and the data fragments per
+# ledger version, so an unchanged ledger is served without re-rendering.
+DASHBOARD_FRAGMENTS = {
+    'stats': STATS_TEMPLATE,
+    'summary': SUMMARY_TEMPLATE,
+    'recent': RECENT_TEMPLATE
+}
+_compiled_templates = {}
+_dashboard_cache = {'shell': (None, None), 'fragments': (None, None)}
 
-        function exportReport() {
-            const month = document.getElementById('monthFilter').value;
-            window.location.href = `/export?month=${month}`;
-        }
-    </script>
-</body>
-</html>
-'''
+def compiled_template(name, source):
+    template = _compiled_templates.get(name)
+    if template is None:
+        template = _compiled_templates[name] = app.jinja_env.from_string(source)
+    return template
 
-@app.route('/')
-def index():
-    data = load_data()
-    
+def ledger_version():
+    return storage.version()
+
+@timed('aggregation')
+def dashboard_context(current_month):
     # Calculate totals
-    total_income = sum(float(item['amount']) for item in data['income'])
-    total_expenses = sum(float(item['amount']) for item in data['expenses'])
-    balance = total_income - total_expenses
+    total_income, total_expenses = storage.totals()
+    balance = from_cents(to_cents(total_income) - to_cents(total_expenses))
     
     # Get recent transactions (last 10)
-    recent_income = []
-    for i, item in enumerate(reversed(data['income'][-10:])):
-        item_copy = item.copy()
-        item_copy['index'] = len(data['income']) - 1 - i
-        recent_income.append(item_copy)
-    
-    recent_expenses = []
-    for i, item in enumerate(reversed(data['expenses'][-10:])):
-        item_copy = item.copy()
-        item_copy['index'] = len(data['expenses']) - 1 - i
-        recent_expenses.append(item_copy)
+    recent_income = storage.recent('income', 10)
+    recent_expenses = storage.recent('expenses', 10)
     
-    # Calculate monthly summary (last 6 months)
-    monthly_summary = defaultdict(lambda: {'income': 0, 'expenses': 0})
-    for item in data['income']:
-        month = item['date'][:7]
-        monthly_summary[month]['income'] += float(item['amount'])
-    for item in data['expenses']:
-        month = item['date'][:7]
-        monthly_summary[month]['expenses'] += float(item['amount'])
-    
-    # Sort and limit to last 6 months
-    monthly_summary = dict(sorted(monthly_summary.items(), reverse=True)[:6])
+    # Monthly summary (last 6 months)
+    monthly_summary = storage.monthly_summary(6)
     
     # Category breakdown for current month
-    current_month = datetime.now().strftime('%Y-%m')
-    category_breakdown = defaultdict(float)
-    for item in data['expenses']:
-        if item['date'].startswith(current_month):
-            category_breakdown[item['category']] += float(item['amount'])
+    category_breakdown = storage.category_totals('expenses', current_month)
     
-    return render_template_string(
-        HTML_TEMPLATE,
-        total_income=total_income,
-        total_expenses=total_expenses,
-        balance=balance,
-        recent_income=recent_income,
-        recent_expenses=recent_expenses,
-        today=datetime.now().strftime('%Y-%m-%d'),
-        current_month=current_month,
-        monthly_summary=monthly_summary,
-        category_breakdown=dict(category_breakdown)
-    )
+    return {
+        'total_income': total_income,
+        'total_expenses': total_expenses,
+        'balance': balance,
+        'recent_income': recent_income,
+        'recent_expenses': recent_expenses,
+        'monthly_summary': monthly_summary,
+        'category_breakdown': category_breakdown
+    }
+
+def render_dashboard(today, current_month):
+    # Taken before loading, so fragments are never cached under a newer
+    # version than the data they were rendered from
+    version = ledger_version()
+
+    shell_key, shell = _dashboard_cache['shell']
+    if shell_key != (today, current_month):
+        # Render with a marker in place of each fragment and keep the static
+        # pieces between them; odd pieces name the fragment to splice in
+        markers = {name: Markup(f'\x00{name}\x00') for name in DASHBOARD_FRAGMENTS}
+        with timed('render'):
+            html = compiled_template('dashboard', HTML_TEMPLATE).render(
+                fragments=markers,
+                today=today,
+                current_month=current_month
+            )
+        shell = html.split('\x00')
+        _dashboard_cache['shell'] = ((today, current_month), shell)
+
+    fragments = dashboard_fragments(version, current_month)
+    return ''.join(fragments[piece] if i % 2 else piece for i, piece in enumerate(shell))
+
+def dashboard_fragments(version, current_month):
+    # Rendered data fragments, shared by page loads and /api/stream
+    fragments_key, fragments = _dashboard_cache['fragments']
+    if fragments_key != (version, current_month):
+        dashboard_cache_stats['misses'] += 1
+        context = dashboard_context(current_month)
+        with timed('render'):
+            fragments = {
+                name: compiled_template(name, source).render(**context)
+                for name, source in DASHBOARD_FRAGMENTS.items()
+            }
+        _dashboard_cache['fragments'] = ((version, current_month), fragments)
+    else:
+        dashboard_cache_stats['hits'] += 1
+    return fragments
+
+# Request metrics: total time and phase breakdown per route, plus the
+# slow-request log. Registered ahead of the conditional GET and compression
+# hooks so the timing covers them too.
+_request_counts = defaultdict(int)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_started
+    route = request.endpoint or 'unmatched'
+    phases = g.get('phases', {})
+    observe('financial_request_seconds', (('route', route),), elapsed)
+    for phase, seconds in phases.items():
+        observe('financial_phase_seconds', (('route', route), ('phase', phase)), seconds)
+    with _metrics_lock:
+        _request_counts[(route, str(response.status_code))] += 1
+
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ' '.join(f'{phase}={phases.get(phase, 0.0) * 1000:.1f}ms' for phase in PHASES)
+        app.logger.warning(
+            'slow request %s %s: %.1fms (%s other=%.1fms)',
+            request.method, request.full_path.rstrip('?'), elapsed * 1000,
+            breakdown, (elapsed - sum(phases.values())) * 1000
+        )
+    return response
+
+def _metric_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+def render_metrics():
+    # Prometheus text exposition format
+    lines = []
+
+    def header(name, kind, description):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    with _metrics_lock:
+        histograms = {key: (list(h['buckets']), h['sum']) for key, h in _histograms.items()}
+        request_counts = dict(_request_counts)
+    for name, description in (
+        ('financial_request_seconds', 'Request handling time by route.'),
+        ('financial_phase_seconds', 'Time spent per request in each phase (load_data, aggregation, render, save).'),
+    ):
+        header(name, 'histogram', description)
+        for (metric, labels), (buckets, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(METRICS_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{_metric_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_metric_labels(labels)} {total}')
+            lines.append(f'{name}_count{_metric_labels(labels)} {cumulative}')
+
+    header('financial_requests_total', 'counter', 'Requests by route and status.')
+    for (route, status), count in sorted(request_counts.items()):
+        lines.append(f'financial_requests_total{_metric_labels((("route", route), ("status", status)))} {count}')
+
+    header('financial_ledger_entries', 'gauge', 'Entries in the ledger.')
+    for kind, count in storage.entry_counts().items():
+        lines.append(f'financial_ledger_entries{_metric_labels((("kind", kind),))} {count}')
+
+    header('financial_storage_bytes', 'gauge', 'Size of the ledger files on disk.')
+    for path in storage.paths:
+        signature = file_signature(path)
+        lines.append(f'financial_storage_bytes{_metric_labels((("file", path),))} {signature[1] if signature else 0}')
+
+    caches = {
+        'dashboard': {'hit': dashboard_cache_stats['hits'], 'miss': dashboard_cache_stats['misses']},
+        'report': {'hit': report_cache_stats['hits'], 'miss': report_cache_stats['misses']}
+    }
+    if isinstance(storage, JsonStorage):
+        caches['ledger'] = {'hit': cache_stats['hits'], 'replay': cache_stats['replays'], 'miss': cache_stats['misses']}
+    header('financial_cache_lookups_total', 'counter', 'Cache lookups by result; a ledger replay only re-read the journal tail.')
+    for cache, results in caches.items():
+        for result, count in results.items():
+            lines.append(f'financial_cache_lookups_total{_metric_labels((("cache", cache), ("result", result)))} {count}')
+    header('financial_cache_hit_ratio', 'gauge', 'Share of cache lookups served without a full reload or re-render.')
+    for cache, results in caches.items():
+        lookups = sum(results.values())
+        ratio = (lookups - results['miss']) / lookups if lookups else 0
+        lines.append(f'financial_cache_hit_ratio{_metric_labels((("cache", cache),))} {ratio:.4f}')
+
+    header('financial_writes_total', 'counter', 'Entries written by this worker, by operation.')
+    for op, count in write_stats.items():
+        lines.append(f'financial_writes_total{_metric_labels((("op", op),))} {count}')
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Conditional GET: the ETag and Last-Modified of the read endpoints come
+# from the ledger files' stat() and today's date, so a client holding a
+# current copy gets a 304 before any data is loaded
+def ledger_last_modified():
+    mtimes = [signature[2] for signature in map(file_signature, storage.paths) if signature]
+    # Pages also change at midnight (today's date, current month)
+    midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    last_modified = int(max([midnight] + [mtime / 1e9 for mtime in mtimes]))
+    if last_modified >= int(time.time()) - 1:
+        # Last-Modified has whole seconds, and the ledger may change again
+        # within this one (or, as file mtimes come from a coarser clock, get
+        # an mtime in it a little later): a copy dated it could never be
+        # told apart from a newer one, so it gets none (the ETag still
+        # validates it)
+        return None
+    return datetime.fromtimestamp(last_modified, timezone.utc)
+
+@app.before_request
+def conditional_get():
+    if request.method != 'GET' or request.endpoint not in CONDITIONAL_ENDPOINTS:
+        return None
+    version = ledger_version() + datetime.now().strftime('%Y-%m-%d')
+    g.etag = hashlib.sha1(version.encode()).hexdigest()[:20]
+    g.last_modified = ledger_last_modified()
+
+    if request.if_none_match:
+        not_modified = any(
+            request.if_none_match.contains(tag)
+            for tag in (g.etag, f'{g.etag}-gzip', f'{g.etag}-deflate')
+        )
+    else:
+        not_modified = (request.if_modified_since is not None and g.last_modified is not None
+                        and request.if_modified_since >= g.last_modified)
+    if not_modified:
+        response = Response(status=304)
+        response.set_etag(g.etag)
+        if g.last_modified is not None:
+            response.last_modified = g.last_modified
+        return response
+    return None
+
+@app.after_request
+def cache_headers_and_compress(response):
+    if response.status_code != 200:
+        return response
+    if 'etag' in g:
+        response.set_etag(g.etag)
+        if g.last_modified is not None:
+            response.last_modified = g.last_modified
+
+    if response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = gzip_chunks(response.response, encoding)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(b''.join(gzip_chunks([body], encoding)))
+    response.headers['Content-Encoding'] = encoding
+    if 'etag' in g:
+        # Each encoding is its own representation
+        response.set_etag(f'{g.etag}-{encoding}')
+    return response
+
+@app.route('/')
+def index():
+    now = datetime.now()
+    return render_dashboard(now.strftime('%Y-%m-%d'), now.strftime('%Y-%m'))
 
 @app.route('/add_income', methods=['POST'])
 def add_income():
-    data = load_data()
+    try:
+        date = parse_entry_date(request.form['date'])
+    except ValueError as e:
+        return str(e), 400
     income_entry = {
-        'date': request.form['date'],
+        'date': date,
         'description': request.form['description'],
-        'amount': float(request.form['amount']),
+        'amount': from_cents(to_cents(request.form['amount'])),
         'category': request.form['category'],
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'id': new_entry_id()
     }
-    data['income'].append(income_entry)
-    save_data(data)
+    storage.add_entry('income', income_entry)
     return redirect(url_for('index'))
 
 @app.route('/add_expense', methods=['POST'])
 def add_expense():
-    data = load_data()
+    try:
+        date = parse_entry_date(request.form['date'])
+    except ValueError as e:
+        return str(e), 400
     expense_entry = {
-        'date': request.form['date'],
+        'date': date,
         'description': request.form['description'],
-        'amount': float(request.form['amount']),
+        'amount': from_cents(to_cents(request.form['amount'])),
         'category': request.form['category'],
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'id': new_entry_id()
     }
-    data['expenses'].append(expense_entry)
-    save_data(data)
+    storage.add_entry('expenses', expense_entry)
     return redirect(url_for('index'))
 
 @app.route('/delete_income', methods=['POST'])
 def delete_income():
-    data = load_data()
-    index = int(request.form['index'])
-    if 0 <= index < len(data['income']):
-        del data['income'][index]
-        save_data(data)
+    if 'id' in request.form:
+        storage.delete_ids([request.form['id']], 'income')
+    else:
+        storage.delete_entry('income', int(request.form['index']))
     return redirect(url_for('index'))
 
 @app.route('/delete_expense', methods=['POST'])
 def delete_expense():
-    data = load_data()
-    index = int(request.form['index'])
-    if 0 <= index < len(data['expenses']):
-        del data['expenses'][index]
-        save_data(data)
+    if 'id' in request.form:
+        storage.delete_ids([request.form['id']], 'expenses')
+    else:
+        storage.delete_entry('expenses', int(request.form['index']))
     return redirect(url_for('index'))
 
 @app.route('/export')
 def export_csv():
-    import csv
-    from flask import Response
-    import io
-    
-    data = load_data()
     month_filter = request.args.get('month', '')
+    compress = request.args.get('gzip') == '1'
+    try:
+        start, end = request_date_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start is None:
+        start = end = month_filter
+        label = month_filter or 'all'
+    else:
+        label = f"{start or 'start'}_{end or 'end'}"
     
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write headers
-    writer.writerow(['Type', 'Date', 'Description', 'Category', 'Amount (€)'])
-    
-    # Write income entries
-    for item in data['income']:
-        if not month_filter or item['date'].startswith(month_filter):
-            writer.writerow(['Income', item['date'], item['description'], item['category'], item['amount']])
-    
-    # Write expense entries
-    for item in data['expenses']:
-        if not month_filter or item['date'].startswith(month_filter):
-            writer.writerow(['Expense', item['date'], item['description'], item['category'], item['amount']])
+    def export_rows():
+        # Write headers
+        yield ['Type', 'Date', 'Description', 'Category', 'Amount (€)']
+        
+        # Write income entries
+        for item in storage.iter_entries('income', start, end):
+            yield ['Income', item['date'], item['description'], item['category'], item['amount']]
+        
+        # Write expense entries
+        for item in storage.iter_entries('expenses', start, end):
+            yield ['Expense', item['date'], item['description'], item['category'], item['amount']]
     
-    # Create response
-    response = Response(output.getvalue(), mimetype='text/csv')
-    filename = f"financial_report_{month_filter or 'all'}.csv"
+    # Create response, streamed so memory stays flat however large the export
+    body = csv_chunks(export_rows())
+    filename = f"financial_report_{label}.csv"
+    if compress:
+        body = gzip_chunks(body)
+        response = Response(stream_with_context(body), mimetype='application/gzip')
+        filename += '.gz'
+    else:
+        response = Response(stream_with_context(body), mimetype='text/csv')
     response.headers['Content-Disposition'] = f'attachment; filename={filename}'
     
     return response
 
+def csv_chunks(rows):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for row in rows:
+        writer.writerow(row)
+        if output.tell() >= EXPORT_CHUNK_SIZE:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+    yield output.getvalue()
+
+# zlib window bits for each content coding
+ENCODING_WBITS = {'gzip': 31, 'deflate': 15}
+
+def gzip_chunks(chunks, encoding='gzip'):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, ENCODING_WBITS[encoding])
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
 @app.route('/api/summary')
 def api_summary():
-    data = load_data()
+    try:
+        start, end = request_date_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    group = request.args.get('group', '')
+    if group and group not in SERIES_GROUPS:
+        return jsonify({'error': f'invalid group: {group}'}), 400
+
+    if start is not None or group:
+        # Date range, optionally broken down into a day/month/quarter/year series
+        start = start or ''
+        end = end or ''
+        income, expenses = storage.range_totals(start, end)
+        summary = {
+            'from': start,
+            'to': end,
+            'income': income,
+            'expenses': expenses,
+            'balance': from_cents(to_cents(income) - to_cents(expenses))
+        }
+        if group:
+            summary['group'] = group
+            summary['series'] = storage.series(start, end, group)
+        return jsonify(summary)
+
     month = request.args.get('month', datetime.now().strftime('%Y-%m'))
     
-    monthly_income = sum(float(item['amount']) for item in data['income'] if item['date'].startswith(month))
-    monthly_expenses = sum(float(item['amount']) for item in data['expenses'] if item['date'].startswith(month))
+    monthly_income, monthly_expenses = storage.range_totals(month, month)
     
     return jsonify({
         'month': month,
         'income': monthly_income,
         'expenses': monthly_expenses,
-        'balance': monthly_income - monthly_expenses
+        'balance': from_cents(to_cents(monthly_income) - to_cents(monthly_expenses))
+    })
+
+# Finished /api/report results by (ledger version, query)
+_report_cache = OrderedDict()
+_report_cache_lock = threading.Lock()
+
+def cached_report(query):
+    # Version taken before building, as for the dashboard fragments
+    key = (ledger_version(), query)
+    with _report_cache_lock:
+        reports = _report_cache.get(key)
+        if reports is not None:
+            _report_cache.move_to_end(key)
+            report_cache_stats['hits'] += 1
+            return reports
+    report_cache_stats['misses'] += 1
+    reports = build_report(*query)
+    with _report_cache_lock:
+        _report_cache[key] = reports
+        while len(_report_cache) > REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+    return reports
+
+@app.route('/api/report')
+def api_report():
+    # ?group=month,category (repeatable, one report each; dimensions from
+    # REPORT_DIMENSIONS), ?type=income|expense, ?from=&to= / ?quarter= /
+    # ?month=, ?category= (repeatable), ?sort=key|income|expenses|balance|count,
+    # ?order=asc|desc, ?top=N
+    type_filter = request.args.get('type', '')
+    sort = request.args.get('sort', 'key')
+    order = request.args.get('order', 'asc' if sort == 'key' else 'desc')
+    try:
+        groupings = []
+        for group in request.args.getlist('group'):
+            grouping = tuple(dimension.strip() for dimension in group.split(','))
+            for dimension in grouping:
+                if dimension not in REPORT_DIMENSIONS:
+                    raise ValueError(f'invalid group: {dimension}')
+            if len(set(grouping)) != len(grouping):
+                raise ValueError(f'invalid group: {group}')
+            groupings.append(grouping)
+        if not groupings:
+            raise ValueError('group is required')
+        if type_filter and type_filter not in BULK_KINDS:
+            raise ValueError(f'invalid type: {type_filter}')
+        if sort not in REPORT_SORTS:
+            raise ValueError(f'invalid sort: {sort}')
+        if order not in ('asc', 'desc'):
+            raise ValueError(f'invalid order: {order}')
+        top = int(request.args['top']) if request.args.get('top') else None
+        if top is not None and top < 1:
+            raise ValueError('top must be at least 1')
+        start, end = request_date_range()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start is None:
+        start = end = request.args.get('month', '')
+
+    kinds = (BULK_KINDS[type_filter],) if type_filter else ('income', 'expenses')
+    categories = frozenset(request.args.getlist('category'))
+    query = (tuple(groupings), kinds, start, end, categories, sort, order == 'desc', top)
+    return jsonify({
+        'from': start,
+        'to': end,
+        'type': type_filter or None,
+        'category': sorted(categories),
+        'reports': cached_report(query)
+    })
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort):
+    # Inverse of encode_cursor; raises ValueError for anything it didn't make.
+    # Search cursors are (score, date, id), listing ones (sort value, id).
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if sort == 'search':
+        if not (isinstance(key, list) and len(key) == 3 and isinstance(key[0], (int, float))
+                and not isinstance(key[0], bool) and isinstance(key[1], str) and isinstance(key[2], str)):
+            raise ValueError('invalid cursor')
+        return tuple(key)
+    value_type = str if sort == 'date' else (int, float)
+    if not (isinstance(key, list) and len(key) == 2 and isinstance(key[0], value_type)
+            and not isinstance(key[0], bool) and isinstance(key[1], str)):
+        raise ValueError('invalid cursor')
+    return tuple(key)
+
+@app.route('/api/transactions')
+def api_transactions():
+    # ?type=income|expense, ?from=&to= / ?quarter= / ?month=, ?category=,
+    # ?sort=date|amount, ?order=desc|asc, ?limit=, ?cursor= from next_cursor
+    type_filter = request.args.get('type', '')
+    sort = request.args.get('sort', 'date')
+    order = request.args.get('order', 'desc')
+    try:
+        if type_filter and type_filter not in BULK_KINDS:
+            raise ValueError(f'invalid type: {type_filter}')
+        if sort not in LISTING_SORTS:
+            raise ValueError(f'invalid sort: {sort}')
+        if order not in ('asc', 'desc'):
+            raise ValueError(f'invalid order: {order}')
+        limit = int(request.args.get('limit', LIST_DEFAULT_LIMIT))
+        if not 1 <= limit <= LIST_MAX_LIMIT:
+            raise ValueError(f'limit must be between 1 and {LIST_MAX_LIMIT}')
+        start, end = request_date_range()
+        after = decode_cursor(request.args['cursor'], sort) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if start is None:
+        start = end = request.args.get('month', '')
+
+    kinds = [BULK_KINDS[type_filter]] if type_filter else ['income', 'expenses']
+    category = request.args.get('category') or None
+    # One extra row tells whether there is a next page
+    page = storage.list_entries(kinds, sort, order == 'desc', start, end, category, after, limit + 1)
+    transactions = [
+        dict(entry, type='income' if kind == 'income' else 'expense')
+        for _, kind, entry in page[:limit]
+    ]
+    return jsonify({
+        'transactions': transactions,
+        'next_cursor': encode_cursor(page[limit - 1][0]) if len(page) > limit else None
+    })
+
+@app.route('/api/search')
+def api_search():
+    # ?q= words matched as prefixes of description words (all must match),
+    # ?type=income|expense, ?from=&to= / ?quarter= / ?month=, ?category=
+    # (repeatable), ?limit=, ?cursor= from next_cursor; best match first,
+    # then newest
+    query = request.args.get('q', '')
+    type_filter = request.args.get('type', '')
+    try:
+        terms = tuple(dict.fromkeys(search_terms(query)))
+        if not terms:
+            raise ValueError('q must contain at least one word')
+        if type_filter and type_filter not in BULK_KINDS:
+            raise ValueError(f'invalid type: {type_filter}')
+        limit = int(request.args.get('limit', LIST_DEFAULT_LIMIT))
+        if not 1 <= limit <= LIST_MAX_LIMIT:
+            raise ValueError(f'limit must be between 1 and {LIST_MAX_LIMIT}')
+        start, end = request_date_range()
+        if start is None:
+            start = end = request.args.get('month', '')
+        for date in (start, end):
+            if date:
+                date_number(date)
+        after = decode_cursor(request.args['cursor'], 'search') if request.args.get('cursor') else None
+        if after is not None:
+            date_number(after[1])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    kinds = tuple([BULK_KINDS[type_filter]] if type_filter else ['income', 'expenses'])
+    categories = frozenset(request.args.getlist('category'))
+    # One extra row tells whether there is a next page
+    page = storage.search(terms, kinds, start, end, categories, after, limit + 1)
+    transactions = [
+        dict(entry, type='income' if kind == 'income' else 'expense', score=round(key[0], 4))
+        for key, kind, entry in page[:limit]
+    ]
+    return jsonify({
+        'query': list(terms),
+        'transactions': transactions,
+        'next_cursor': encode_cursor(page[limit - 1][0]) if len(page) > limit else None
+    })
+
+def totals_json(income, expenses):
+    return {'income': income, 'expenses': expenses, 'balance': from_cents(to_cents(income) - to_cents(expenses))}
+
+@app.route('/api/transactions', methods=['POST'])
+def create_transaction():
+    # JSON {"type", "date", "description", "amount", "category"}; answers
+    # with the new entry and the totals it counts towards
+    row = request.get_json(silent=True)
+    if not isinstance(row, dict):
+        return jsonify({'error': 'expected a JSON object'}), 400
+    try:
+        kind, entry = parse_bulk_row(row, datetime.now().isoformat())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    storage.add_entry(kind, entry)
+
+    month = entry['date'][:7]
+    month_income, month_expenses = storage.range_totals(month, month)
+    return jsonify({
+        'transaction': dict(entry, type='income' if kind == 'income' else 'expense'),
+        'aggregates': {
+            'totals': totals_json(*storage.totals()),
+            'month': dict(totals_json(month_income, month_expenses), month=month),
+            'category': {
+                'month': month,
+                'category': entry['category'],
+                'amount': storage.category_totals(kind, month).get(entry['category'], 0.0)
+            }
+        }
+    }), 201
+
+_stream_slots = threading.BoundedSemaphore(STREAM_MAX_OPEN)
+
+@app.route('/api/stream')
+def ledger_stream():
+    # Server-Sent Events for open dashboards: a 'ledger' event with the
+    # rendered fragments that changed, whenever the ledger version does. The
+    # version is polled, so writes made by any worker reach every stream;
+    # each open stream holds a thread, hence the limits above.
+    if not _stream_slots.acquire(blocking=False):
+        return Response(f'retry: {STREAM_BUSY_RETRY_MS}\n\n', mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    def events():
+        yield f'retry: {STREAM_RETRY_MS}\n\n'
+        sent = {}
+        version = None
+        quiet = 0.0
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            current = ledger_version()
+            if current != version:
+                version = current
+                fragments = dashboard_fragments(version, datetime.now().strftime('%Y-%m'))
+                changed = {name: html for name, html in fragments.items() if sent.get(name) != html}
+                sent = fragments
+                if changed:
+                    yield f'event: ledger\ndata: {json.dumps(changed)}\n\n'
+                    quiet = 0.0
+            if quiet >= STREAM_KEEPALIVE_INTERVAL:
+                yield ': keepalive\n\n'
+                quiet = 0.0
+            time.sleep(STREAM_POLL_INTERVAL)
+            quiet += STREAM_POLL_INTERVAL
+
+    response = Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Released when the server closes the response, however the stream ends
+    response.call_on_close(_stream_slots.release)
+    return response
+
+# Column names accepted in bulk CSV uploads, including the /export header
+BULK_COLUMNS = {
+    'type': 'type',
+    'date': 'date',
+    'description': 'description',
+    'category': 'category',
+    'amount': 'amount',
+    'amount (€)': 'amount',
+}
+BULK_KINDS = {'income': 'income', 'expense': 'expenses', 'expenses': 'expenses'}
+
+def parse_entry_date(date):
+    # The date of a new entry as 'YYYY-MM-DD'; raises ValueError
+    date = date.strip()
+    try:
+        if len(date) != 10:
+            raise ValueError
+        datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError('date must be YYYY-MM-DD')
+    return date
+
+def parse_bulk_row(row, timestamp):
+    # Validates one uploaded row and returns (kind, entry); raises ValueError
+    kind = BULK_KINDS.get(str(row.get('type', '')).strip().lower())
+    if kind is None:
+        raise ValueError("type must be 'income' or 'expense'")
+    date = parse_entry_date(str(row.get('date', '')))
+    try:
+        amount = float(row.get('amount'))
+    except (TypeError, ValueError):
+        raise ValueError('amount must be a number')
+    if amount != amount or amount in (float('inf'), float('-inf')):
+        raise ValueError('amount must be a number')
+    category = str(row.get('category') or '').strip()
+    if not category:
+        raise ValueError('category is required')
+    return kind, {
+        'date': date,
+        'description': str(row.get('description') or ''),
+        'amount': from_cents(to_cents(amount)),
+        'category': category,
+        'timestamp': timestamp,
+        'id': new_entry_id()
+    }
+
+def iter_bulk_rows(stream, fmt):
+    # Yields (row number, dict or parse error) as the upload is read
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.reader(text)
+        header = next(reader, [])
+        columns = [BULK_COLUMNS.get(name.strip().lower()) for name in header]
+        missing = {'type', 'date', 'amount', 'category'} - set(columns)
+        if missing:
+            raise ValueError(f"CSV header is missing: {', '.join(sorted(missing))}")
+        for number, values in enumerate(reader, 1):
+            if values:
+                yield number, {column: value for column, value in zip(columns, values) if column}
+    else:
+        for number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, ValueError('invalid JSON')
+                continue
+            yield number, row if isinstance(row, dict) else ValueError('row must be a JSON object')
+
+@app.route('/api/transactions/bulk', methods=['POST'])
+def bulk_transactions():
+    fmt = request.args.get('format')
+    if fmt is None:
+        if request.mimetype in ('text/csv', 'application/csv'):
+            fmt = 'csv'
+        elif request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json-lines'):
+            fmt = 'jsonl'
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'error': 'send text/csv or application/x-ndjson (or ?format=csv|jsonl)'}), 415
+
+    # Rows are validated as they stream in, then committed in a single write
+    timestamp = datetime.now().isoformat()
+    records = []
+    errors = []
+    rejected = 0
+    try:
+        for number, row in iter_bulk_rows(request.stream, fmt):
+            try:
+                if isinstance(row, ValueError):
+                    raise row
+                kind, entry = parse_bulk_row(row, timestamp)
+            except ValueError as e:
+                rejected += 1
+                if len(errors) < BULK_MAX_ERRORS:
+                    errors.append({'row': number, 'error': str(e)})
+                continue
+            records.append({'op': 'add', 'kind': kind, 'entry': entry})
+    except (ValueError, csv.Error) as e:
+        return jsonify({'error': str(e)}), 400
+
+    if records:
+        storage.write(records)
+    return jsonify({
+        'accepted': len(records),
+        'rejected': rejected,
+        'errors': errors
+    })
+
+@app.route('/api/transactions/delete', methods=['POST'])
+def batch_delete_transactions():
+    payload = request.get_json(silent=True)
+    ids = payload.get('ids') if isinstance(payload, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(entry_id, str) for entry_id in ids):
+        return jsonify({'error': 'expected a JSON body like {"ids": ["...", ...]}'}), 400
+
+    deleted = storage.delete_ids(ids)
+    deleted_ids = set(deleted)
+    return jsonify({
+        'deleted': deleted,
+        'missing': [entry_id for entry_id in dict.fromkeys(ids) if entry_id not in deleted_ids],
+        'aggregates': {'totals': totals_json(*storage.totals())}
     })
 
 if __name__ == '__main__':
-    init_data()
+    storage.init()
     # For production deployment, use a proper WSGI server like Gunicorn
     # For local testing, you can use:
     # Port 5001 is used to avoid conflicts with macOS AirPlay Receiver (port 5000)
@@ -0,0 +1,477 @@
+"""Benchmarks for the ledger app.
+
+    python bench.py generate --entries 1000000 --out /tmp/ledger
+    python bench.py run --sizes 1000,10000,100000
+    python bench.py run --mode gunicorn --workers 4 --baseline bench_baseline.json
+
+`run` builds a seeded ledger for each size in a scratch directory and times
+every route through the Flask test client (one process per size, so peak RSS
+is per size) and/or against a local multi-worker gunicorn. Results are written
+as JSON; with --baseline, p50/p99 latency and throughput are compared against
+an earlier results file and the exit status is 1 if any regressed by more
+than --threshold. Against gunicorn, the ledger's entry counts are also read
+before and after each add route, and the exit status is 1 if any accepted
+add is missing from them.
+"""
+from datetime import date, timedelta
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import click
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Share of entries that are income, and per category: weight, amount range
+# and descriptions. Categories match the dashboard's forms.
+INCOME_SHARE = 0.08
+INCOME_CATEGORIES = {
+    'Salary': (5, (2200, 5200), ['Monthly salary', 'Salary', 'Payroll']),
+    'Freelance': (3, (80, 2500), ['Client invoice', 'Consulting', 'Design work']),
+    'Investment': (2, (5, 900), ['Dividends', 'Interest', 'Fund payout']),
+    'Business': (1, (150, 6000), ['Shop revenue', 'Contract payment']),
+    'Other': (1, (5, 400), ['Refund', 'Gift', 'Sold item']),
+}
+EXPENSE_CATEGORIES = {
+    'Food': (30, (2, 120), ['Groceries', 'Restaurant', 'Coffee', 'Lunch', 'Bakery']),
+    'Transport': (15, (1.5, 90), ['Fuel', 'Train ticket', 'Bus pass', 'Taxi', 'Parking']),
+    'Housing': (3, (400, 1800), ['Rent', 'Mortgage', 'Repairs']),
+    'Utilities': (6, (20, 250), ['Electricity', 'Water', 'Internet', 'Phone']),
+    'Healthcare': (3, (10, 400), ['Pharmacy', 'Dentist', 'Doctor']),
+    'Entertainment': (10, (5, 150), ['Cinema', 'Concert', 'Streaming', 'Games']),
+    'Shopping': (15, (5, 400), ['Clothes', 'Electronics', 'Books', 'Home goods']),
+    'Education': (3, (10, 600), ['Course', 'Textbooks', 'Tuition']),
+    'Other': (5, (1, 200), ['Miscellaneous', 'Gift', 'Donation']),
+}
+
+DEFAULT_SIZES = '1000,10000,100000'
+# Export streams the whole ledger, so it gets fewer repetitions than the rest
+EXPORT_REQUESTS = 5
+GUNICORN_START_TIMEOUT = 600
+# Add routes, by the kind of entry they write
+ADD_ROUTES = {'POST /add_income': 'income', 'POST /add_expense': 'expenses'}
+
+# Entry generation
+
+def generate_entries(kind, count, rng, end, years):
+    # Yields `count` entries of one kind in date order, spread over `years`
+    # years ending at `end`
+    categories = INCOME_CATEGORIES if kind == 'income' else EXPENSE_CATEGORIES
+    names = list(categories)
+    weights = [categories[name][0] for name in names]
+    span = max(1, int(365 * years))
+    start = end - timedelta(days=span - 1)
+    for i in range(count):
+        day = start + timedelta(days=i * span // max(1, count))
+        category = rng.choices(names, weights)[0]
+        _, (low, high), descriptions = categories[category]
+        yield {
+            'date': day.isoformat(),
+            'description': rng.choice(descriptions),
+            'amount': round(rng.uniform(low, high), 2),
+            'category': category,
+            'timestamp': f'{day.isoformat()}T{rng.randrange(24):02d}:{rng.randrange(60):02d}:00',
+            'id': '%016x' % rng.getrandbits(64),
+        }
+
+def split_counts(entries):
+    income = round(entries * INCOME_SHARE)
+    return {'income': income, 'expenses': entries - income}
+
+def generate_ledger(directory, entries, seed=1, backend='json', end=None, years=5):
+    # Writes a ledger of `entries` entries into `directory` as the app's data
+    # file for `backend`. The JSON file is streamed, so 10M entries never sit
+    # in memory at once.
+    rng = random.Random(seed)
+    end = end or date.today()
+    counts = split_counts(entries)
+    os.makedirs(directory, exist_ok=True)
+    if backend == 'json':
+        with open(os.path.join(directory, 'financial_data.json'), 'w') as f:
+            for n, kind in enumerate(('income', 'expenses')):
+                f.write('{"income": [' if n == 0 else '], "expenses": [')
+                for i, entry in enumerate(generate_entries(kind, counts[kind], rng, end, years)):
+                    f.write(',\n' if i else '\n')
+                    f.write(json.dumps(entry))
+            f.write('], "generation": 0}\n')
+        return
+
+    sys.path.insert(0, REPO_DIR)
+    import app
+    storage = app.SqliteStorage(os.path.join(directory, app.SQLITE_FILE))
+    storage.init()
+    for kind in ('income', 'expenses'):
+        batch = []
+        for entry in generate_entries(kind, counts[kind], rng, end, years):
+            batch.append({'op': 'add', 'kind': kind, 'entry': entry})
+            if len(batch) == 10000:
+                storage.write(batch)
+                batch = []
+        storage.write(batch)
+
+def import_app(directory, backend):
+    # The app keeps its data files in the working directory and picks its
+    # backend at import time
+    os.chdir(directory)
+    os.environ['STORAGE_BACKEND'] = backend
+    sys.path.insert(0, REPO_DIR)
+    import app
+    return app
+
+# Timing
+
+def percentile(samples, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+def summarize(route, latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'route': route,
+        'count': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if count else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if count else None,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else None,
+        'throughput_rps': round(count / elapsed, 1) if elapsed else None,
+    }
+
+def route_plan(requests, month):
+    # (route name, method, path, form or None, repetitions). Deletes take
+    # their IDs from the runner.
+    form = {'date': f'{month}-15', 'description': 'Benchmark', 'amount': '12.34', 'category': 'Other'}
+    return [
+        ('GET /', 'GET', '/', None, requests),
+        ('GET /api/summary', 'GET', '/api/summary', None, requests),
+        ('GET /api/summary?group=month', 'GET', '/api/summary?from=2000-01&to=2100-12&group=month', None, requests),
+        ('GET /api/transactions', 'GET', '/api/transactions?limit=50', None, requests),
+        ('GET /export?month', 'GET', f'/export?month={month}', None, requests),
+        ('GET /export', 'GET', '/export', None, min(requests, EXPORT_REQUESTS)),
+        ('POST /add_income', 'POST', '/add_income', form, requests),
+        ('POST /add_expense', 'POST', '/add_expense', form, requests),
+        ('POST /delete_income', 'POST', '/delete_income', 'income', requests),
+        ('POST /delete_expense', 'POST', '/delete_expense', 'expenses', requests),
+    ]
+
+def client_benchmark(directory, backend, requests):
+    # Runs inside a fresh process; returns one summary per route
+    app = import_app(directory, backend)
+    client = app.app.test_client()
+    month = date.today().strftime('%Y-%m')
+
+    started = time.perf_counter()
+    client.get('/')
+    cold_start = time.perf_counter() - started
+    results = [summarize('GET / (cold)', [cold_start], 0, cold_start)]
+
+    for route, method, path, form, repetitions in route_plan(requests, month):
+        if isinstance(form, str):
+            # Newest entries of the kind, which the adds above just wrote
+            kind = form
+            forms = [{'id': entry['id']} for entry in app.storage.recent(kind, repetitions)]
+        else:
+            forms = [form] * repetitions
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for form in forms:
+            t = time.perf_counter()
+            if method == 'GET':
+                response = client.get(path)
+                response.get_data()
+            else:
+                response = client.post(path, data=form)
+            latencies.append(time.perf_counter() - t)
+            errors += response.status_code >= 400
+        results.append(summarize(route, latencies, errors, time.perf_counter() - started))
+
+    peak_rss_mb = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    for result in results:
+        result['peak_rss_mb'] = peak_rss_mb
+    return results
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def http_request(conn, method, path, form=None):
+    body = urlencode(form) if form else None
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    if response.getheader('Connection', '').lower() == 'close':
+        conn.close()
+    return response.status
+
+def process_tree(pid):
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f'/proc/{child}/task/{child}/children') as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def peak_rss_kb(pid):
+    # VmHWM: the process's peak resident set size
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def gunicorn_benchmark(directory, backend, requests, workers, concurrency):
+    port = free_port()
+    env = dict(os.environ, STORAGE_BACKEND=backend)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+         '--chdir', directory, '--pythonpath', REPO_DIR, '--timeout', '600', 'app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        started = time.perf_counter()
+        while True:
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=GUNICORN_START_TIMEOUT)
+                if http_request(conn, 'GET', '/') < 400:
+                    break
+            except OSError:
+                if server.poll() is not None or time.perf_counter() - started > GUNICORN_START_TIMEOUT:
+                    raise click.ClickException('gunicorn did not start')
+                time.sleep(0.2)
+        cold_start = time.perf_counter() - started
+        results = [summarize('GET / (cold)', [cold_start], 0, cold_start)]
+
+        month = date.today().strftime('%Y-%m')
+        for route, method, path, form, repetitions in route_plan(requests, month):
+            if isinstance(form, str):
+                forms = [{'id': entry_id} for entry_id in newest_ids(port, form, repetitions)]
+            else:
+                forms = [form] * repetitions
+            kind = ADD_ROUTES.get(route)
+            if kind:
+                before = ledger_counts(directory, backend)[kind]
+            result = load_test(port, route, method, path, forms, concurrency)
+            if kind:
+                # Every accepted add must show up, however the workers interleaved
+                added = ledger_counts(directory, backend)[kind] - before
+                result['lost_updates'] = result['count'] - result['errors'] - added
+            results.append(result)
+
+        pids = process_tree(server.pid)
+        worker_rss = [peak_rss_kb(pid) for pid in pids[1:]]
+        for result in results:
+            result['peak_rss_mb'] = round(sum(peak_rss_kb(pid) for pid in pids) / 1024, 1)
+            result['peak_worker_rss_mb'] = round(max(worker_rss, default=0) / 1024, 1)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+def ledger_counts(directory, backend):
+    # Read from a separate process, as another worker would
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), 'counts', '--dir', directory, '--backend', backend],
+        check=True, stdout=subprocess.PIPE, text=True
+    )
+    return json.loads(child.stdout)
+
+def newest_ids(port, kind, count):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    query = urlencode({'type': 'income' if kind == 'income' else 'expense', 'sort': 'date', 'limit': min(count, 500)})
+    ids, cursor = [], None
+    while len(ids) < count:
+        conn.request('GET', '/api/transactions?' + query + (f'&cursor={cursor}' if cursor else ''))
+        page = json.loads(conn.getresponse().read())
+        ids.extend(entry['id'] for entry in page['transactions'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    conn.close()
+    return ids[:count]
+
+def load_test(port, route, method, path, forms, concurrency):
+    # `concurrency` client threads share the request list until it runs out
+    pending = iter(forms)
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+        while True:
+            with lock:
+                form = next(pending, StopIteration)
+            if form is StopIteration:
+                break
+            t = time.perf_counter()
+            try:
+                status = http_request(conn, method, path, form)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                status = 599
+            elapsed = time.perf_counter() - t
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += status >= 400
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(route, latencies, errors[0], time.perf_counter() - started)
+
+# Regression checks
+
+def compare(results, baseline, threshold, min_delta_ms):
+    # A latency regresses when it grows past threshold x baseline and by more
+    # than min_delta_ms; throughput when it drops below baseline / threshold
+    previous = {(r['mode'], r['backend'], r['size'], r['route']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['mode'], result['backend'], result['size'], result['route']))
+        if before is None or result['route'].endswith('(cold)'):
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            old, new = before.get(metric), result.get(metric)
+            if old is not None and new is not None and new > old * threshold and new - old > min_delta_ms:
+                regressions.append(dict(route=result['route'], mode=result['mode'], size=result['size'],
+                                        metric=metric, baseline=old, current=new))
+        old, new = before.get('throughput_rps'), result.get('throughput_rps')
+        if old and new is not None and new < old / threshold:
+            regressions.append(dict(route=result['route'], mode=result['mode'], size=result['size'],
+                                    metric='throughput_rps', baseline=old, current=new))
+    return regressions
+
+# Commands
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.option('--entries', type=int, required=True, help='Total number of entries (1k to 10M).')
+@click.option('--out', 'directory', required=True, type=click.Path(file_okay=False), help='Directory to write the ledger into.')
+@click.option('--seed', type=int, default=1, show_default=True)
+@click.option('--backend', type=click.Choice(['json', 'sqlite']), default='json', show_default=True)
+@click.option('--years', type=float, default=5, show_default=True, help='Span of dates, ending today.')
+def generate(entries, directory, seed, backend, years):
+    """Write a seeded synthetic ledger."""
+    started = time.perf_counter()
+    generate_ledger(os.path.abspath(directory), entries, seed, backend, years=years)
+    click.echo(f'Generated {entries} entries in {directory} ({time.perf_counter() - started:.1f}s)')
+
+@cli.command()
+@click.option('--sizes', default=DEFAULT_SIZES, show_default=True, help='Comma-separated ledger sizes.')
+@click.option('--mode', type=click.Choice(['client', 'gunicorn', 'both']), default='client', show_default=True)
+@click.option('--backend', type=click.Choice(['json', 'sqlite']), default='json', show_default=True)
+@click.option('--requests', type=int, default=200, show_default=True, help='Requests per route.')
+@click.option('--workers', type=int, default=4, show_default=True, help='gunicorn workers.')
+@click.option('--concurrency', type=int, default=8, show_default=True, help='Client threads against gunicorn.')
+@click.option('--seed', type=int, default=1, show_default=True)
+@click.option('--output', default='bench_results.json', show_default=True, type=click.Path(dir_okay=False))
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Earlier results to compare against.')
+@click.option('--threshold', type=float, default=1.25, show_default=True, help='Allowed slowdown factor.')
+@click.option('--min-delta-ms', type=float, default=1.0, show_default=True, help='Ignore latency changes smaller than this.')
+def run(sizes, mode, backend, requests, workers, concurrency, seed, output, baseline, threshold, min_delta_ms):
+    """Benchmark every route at each ledger size."""
+    modes = ['client', 'gunicorn'] if mode == 'both' else [mode]
+    results = []
+    for size in [int(size) for size in sizes.split(',')]:
+        for current_mode in modes:
+            directory = tempfile.mkdtemp(prefix=f'bench-{size}-')
+            try:
+                generate_ledger(directory, size, seed, backend)
+                if current_mode == 'client':
+                    child = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), 'client', '--dir', directory,
+                         '--backend', backend, '--requests', str(requests)],
+                        check=True, stdout=subprocess.PIPE, text=True
+                    )
+                    size_results = json.loads(child.stdout)
+                else:
+                    size_results = gunicorn_benchmark(directory, backend, requests, workers, concurrency)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            for result in size_results:
+                result.update(mode=current_mode, backend=backend, size=size)
+                click.echo(
+                    f"{current_mode:8} {size:>9} {result['route']:32} p50 {result['p50_ms']:>9} ms  "
+                    f"p99 {result['p99_ms']:>9} ms  {result['throughput_rps']:>8} req/s  "
+                    f"rss {result['peak_rss_mb']} MB" + (f"  errors {result['errors']}" if result['errors'] else '')
+                    + (f"  lost updates {result['lost_updates']}" if result.get('lost_updates') else '')
+                )
+            results.extend(size_results)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': backend,
+            'seed': seed,
+            'requests': requests,
+            'workers': workers,
+            'concurrency': concurrency,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if baseline:
+        with open(baseline) as f:
+            report['threshold'] = threshold
+            report['regressions'] = compare(results, json.load(f), threshold, min_delta_ms)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    click.echo(f'Wrote {output}')
+
+    for regression in report.get('regressions', []):
+        click.echo(
+            f"REGRESSION {regression['mode']} {regression['size']} {regression['route']} {regression['metric']}: "
+            f"{regression['baseline']} -> {regression['current']}", err=True
+        )
+    lost = [result for result in results if result.get('lost_updates')]
+    for result in lost:
+        click.echo(
+            f"LOST UPDATES {result['mode']} {result['size']} {result['route']}: {result['lost_updates']}", err=True
+        )
+    if report.get('regressions') or lost:
+        sys.exit(1)
+
+@cli.command(hidden=True)
+@click.option('--dir', 'directory', required=True)
+@click.option('--backend', default='json')
+@click.option('--requests', type=int, default=200)
+def client(directory, backend, requests):
+    """Test-client run for one ledger; prints JSON results."""
+    click.echo(json.dumps(client_benchmark(directory, backend, requests)))
+
+@cli.command(hidden=True)
+@click.option('--dir', 'directory', required=True)
+@click.option('--backend', default='json')
+def counts(directory, backend):
+    """Entries per kind in one ledger; prints JSON."""
+    click.echo(json.dumps(import_app(directory, backend).storage.entry_counts()))
+
+if __name__ == '__main__':
+    cli()